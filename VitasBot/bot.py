@@ -24,41 +24,98 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import os
-import sys
+import time
 import logging
 
 import aiohttp
 import asyncio
 import discord
-import colorlog
 
-from collections import defaultdict
+from collections import Counter, defaultdict
 
 from discord.enums import ChannelType
 
-from .commands import Commands
+from .commands import Commands, split_args
 from .config import ConfigDefaults
 from .constants import VERSION as BOTVERSION
 from .constants import DISCORD_MSG_CHAR_LIMIT
-from .utils import __func__, load_opus_lib
-
-load_opus_lib()
+from .library import MusicLibrary
+from .player import FFmpegSource, GuildPlayer, FRAME_LENGTH
+from .broadcast import Broadcast
+from .members import MemberIndex
+from .pictures import PictureLibrary, UploadCache
+from .variants import VariantStore
+from .workers import AudioWorkers
+from .voicestats import FrameStats
+from .metrics import BotMetrics, MetricsServer
+from .profiler import LoopWatchdog
+from .voice import VoiceManager
+from .sender import MessageSender
+from .presence import PresenceUpdater
+from .logpipe import LogQueueHandler, setup_logging
+from .shards import ShardLink
+from .scheduler import Scheduler, bulk_deletable
+from .sessions import SessionStore
+from .opuscache import OpusCache, OpusFrameReader
+from .startup import StartupTimer
+from .utils import __func__, load_opus_lib, LogSampler
 
 log = logging.getLogger(__name__)
 
+PLAYER_TRACK_STARTED = "track_started"
+PLAYER_FINISHED = "finished"
+
+BROADCAST_KEY = "broadcast"
+
+# Servers named in the startup log, and nicknames changed at the same time
+SERVER_LIST_LIMIT = 20
+NICKNAME_CONCURRENCY = 5
+
 class VitasBot(discord.Client):
     
-    def __init__(self, config=None):
+    def __init__(self, config=None, *, shard_id=None, shard_count=None,
+                 coordinator=None):
         if config is None:
             config = ConfigDefaults()
 
+        self.startup = StartupTimer()
         self.config = config
         self.commands = Commands(self)
         self.players = {}
         self.now_playing = {}
-        self.last_status = None
         self.exit_signal = None
+        self.broadcast = None
+        self.members = MemberIndex()
+        self.voice_stats = {}
+        self.ignored_messages = Counter()
+        self.ignored_log = LogSampler(log, rate=self.config.ignored_log_rate)
+
+        self.library = MusicLibrary(self.config.music_dir,
+            rescan_interval=self.config.music_rescan_interval,
+            probe=self.config.music_probe,
+            loudness_target=self.config.loudness_target if self.config.normalize else None,
+            index_path=self.config.library_index,
+            analyse=not shard_id)
+        self.opus_cache = None
+        self.audio_workers = None
+
+        if self.config.audio_workers > 0:
+            self.audio_workers = AudioWorkers(self.config.audio_workers,
+                slots=self.config.audio_worker_frames)
+        self.pictures = PictureLibrary(self.config.pictures_dir,
+            rescan_interval=self.config.picture_rescan_interval)
+        self.picture_cache = UploadCache(self.config.picture_cache_file,
+            size=self.config.picture_cache_size,
+            ttl=self.config.picture_cache_ttl)
+        self.picture_variants = None
+
+        if self.config.picture_variant_dir:
+            self.picture_variants = VariantStore(self.config.picture_variant_dir,
+                limit=self.config.upload_limit,
+                workers=self.config.picture_variant_workers)
+
+        if self.config.opus_cache_dir:
+            self.opus_cache = OpusCache(self.config.opus_cache_dir)
 
         if self.config.proxy:
             self.connector = aiohttp.ProxyConnector(proxy=self.config.proxy)
@@ -67,62 +124,103 @@ class VitasBot(discord.Client):
 
         self.aiolocks = defaultdict(asyncio.Lock)
         
-        self._setup_logging()
+        self.log_pipeline = self._setup_logging()
 
         options = {
             "connector": self.connector
         }
 
+        if shard_count is not None:
+            options["shard_id"] = shard_id
+            options["shard_count"] = shard_count
+
         super().__init__(loop=None, **options)
 
         self.http.user_agent += " VitasBot/{0}".format(str(BOTVERSION))
 
-    def _setup_logging(self):
-        if len(logging.getLogger(__package__).handlers) > 1:
-            log.debug("Skip logging setup, already complete")
-            return
+        self.player_events = asyncio.Queue(loop=self.loop)
+        self.sender = MessageSender(self,
+            rate=self.config.channel_message_rate,
+            per=self.config.channel_message_window)
+        self.presence = PresenceUpdater(self,
+            debounce=self.config.presence_debounce,
+            interval=self.config.presence_interval)
+        self.scheduler = Scheduler(self, path=self.config.expiry_file)
+        self.sessions = SessionStore(self, path=self.config.session_file,
+            interval=self.config.session_interval)
+        self.voice_manager = VoiceManager(self,
+            concurrency=self.config.voice_concurrency,
+            timeout=self.config.voice_timeout)
+        self.metrics = BotMetrics(self)
+        self.metrics_server = None
+        self.watchdog = None
+        self.shard_link = None
+
+        if coordinator is not None:
+            self.shard_link = ShardLink(self, *coordinator)
+
+        if self.config.stall_threshold > 0:
+            self.watchdog = LoopWatchdog(self.loop,
+                threshold=self.config.stall_threshold,
+                on_lag=self.metrics.observe_loop_lag)
+
+        if self.config.metrics_port:
+            self.metrics_server = MetricsServer(self,
+                host=self.config.metrics_host, port=self.config.metrics_port)
+
+        self._opus_loaded = None
+        self.startup.record("init", self.startup.elapsed())
 
-        shandler = logging.StreamHandler(stream=sys.stdout)
-        shandler.setFormatter(colorlog.LevelFormatter(
-            fmt = {
-                "DEBUG": "{log_color}[{levelname}:{module}] {message}",
-                "INFO": "{log_color}{message}",
-                "WARNING": "{log_color}{levelname}: {message}",
-                "ERROR": "{log_color}[{levelname}:{module}] {message}",
-                "CRITICAL": "{log_color}[{levelname}:{module}] {message}"
-            },
-            log_colors = {
-                "DEBUG":    "cyan",
-                "INFO":     "white",
-                "WARNING":  "yellow",
-                "ERROR":    "red",
-                "CRITICAL": "bold_red"
-            },
-            style = '{',
-            datefmt = ''
-        ))
+    def _setup_logging(self):
+        package_logger = logging.getLogger(__package__)
 
-        log.setLevel(self.config.debug_level)
-        shandler.setLevel(self.config.debug_level)
-        logging.getLogger(__package__).addHandler(shandler)
+        if any(isinstance(h, LogQueueHandler) for h in package_logger.handlers):
+            log.debug("Skip logging setup, already complete")
+            return None
 
+        pipeline = setup_logging(self.config)
         log.debug("Set logging level to {0}".format(self.config.debug_level))
-
-        if self.config.debug_mode:
-            dlogger = logging.getLogger("discord")
-            dlogger.setLevel(logging.DEBUG)
-            os.makedirs("logs", mode=0o644, exist_ok=True)
-            dhandler = logging.FileHandler(filename="logs/discord.log", encoding="utf-8", mode='w')
-            dhandler.setFormatter(logging.Formatter("{asctime}:{levelname}:{name}: {message}", style='{'))
-            dlogger.addHandler(dhandler)
+        return pipeline
 
     def _get_member_from_id(self, user_id, *, server=None, voice=False):
-        return discord.utils.find(
-            lambda m: m.id == user_id and (m.voice_channel if voice else True),
-            server.members if server else self.get_all_members()
-        )
+        return self.members.get(user_id, server=server, voice=voice)
+
+    def is_owner(self, user):
+        return user.id in self.config.owner_id
 
     def _cleanup(self):
+        self.library.stop()
+        self.pictures.stop()
+        self.stop_broadcast()
+
+        if self.watchdog:
+            self.watchdog.stop()
+
+        try:
+            self.scheduler.save()
+        except OSError as e:
+            log.error("Unable to save pending expiries: {0}".format(e))
+
+        try:
+            self.sessions.save()
+        except OSError as e:
+            log.error("Unable to save sessions: {0}".format(e))
+
+        if self.opus_cache:
+            self.opus_cache.stop()
+
+        if self.picture_variants:
+            self.picture_variants.stop()
+
+        if self.audio_workers is not None:
+            self.audio_workers.stop()
+
+        try:
+            if self.metrics_server:
+                self.loop.run_until_complete(self.metrics_server.stop())
+        except Exception:
+            log.exception("Failed to stop the metrics server")
+
         try:
             self.loop.run_until_complete(self.logout())
         except:
@@ -140,6 +238,48 @@ class VitasBot(discord.Client):
 
     # noinspection PyMethodOverriding
     def run(self):
+        # Worker processes are forked before any other thread is running
+        with self.startup.phase("workers"):
+            if self.audio_workers is not None:
+                self.audio_workers.start()
+
+            # Every shard makes picture variants on demand, so each has a pool
+            if self.picture_variants:
+                self.picture_variants.start()
+
+        # Shards share the variant directory, the first one fills it
+        if self.picture_variants and not self.shard_id:
+            with self.startup.phase("pictures"):
+                self.pictures.rescan()
+                self.picture_variants.request_all(self.pictures.pictures())
+
+        # The log writer thread starts only now, after the forks above
+        if self.log_pipeline:
+            self.log_pipeline.start()
+
+        # Opus is only needed once there is something to play, so it loads
+        # in the background while the bot logs in
+        self._opus_loaded = self.loop.run_in_executor(None, self._load_opus)
+        self._opus_loaded.add_done_callback(self._opus_load_done)
+
+        self.library.start()
+        self.pictures.start()
+        self.loop.create_task(self._wait_library())
+        self.loop.create_task(self._player_supervisor())
+        self.loop.create_task(self.presence.run())
+        self.loop.create_task(self.scheduler.run())
+        self.loop.create_task(self.voice_manager.run())
+        self.loop.create_task(self.sessions.run())
+
+        if self.shard_link:
+            self.loop.create_task(self.shard_link.run())
+
+        if self.watchdog:
+            self.watchdog.start()
+
+        if self.metrics_server:
+            self.loop.create_task(self._start_metrics_server())
+
         try:
             self.loop.run_until_complete(self.start(self.config.token))
         except discord.errors.LoginFailure:
@@ -155,10 +295,53 @@ class VitasBot(discord.Client):
 
             self.loop.close()
 
+            if self.log_pipeline:
+                self.log_pipeline.stop()
+
             if self.exit_signal:
                 raise self.exit_signal
 
-    async def join_voice_channel(self, channel):
+    async def start(self, *args, **kwargs):
+        with self.startup.phase("login"):
+            await self.login(*args, **kwargs)
+
+        self.startup.mark("gateway")
+        await self.connect()
+
+    def _load_opus(self):
+        with self.startup.phase("opus"):
+            load_opus_lib()
+
+    def _opus_load_done(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            log.error("Voice is unavailable: {0}".format(future.exception()))
+
+    async def ensure_opus(self):
+        # Raises the RuntimeError of load_opus_lib if no opus lib was found
+        if self._opus_loaded is None:
+            self._opus_loaded = self.loop.run_in_executor(None, self._load_opus)
+
+        await asyncio.shield(self._opus_loaded, loop=self.loop)
+
+    async def _wait_library(self):
+        await self.loop.run_in_executor(None, self.library.ready.wait)
+        self.startup.record("library", self.startup.elapsed())
+
+    async def close(self):
+        # Capture playback before the voice connections go away
+        if not self.is_closed:
+            self.sessions.capture()
+
+        await super().close()
+
+    async def _start_metrics_server(self):
+        try:
+            await self.metrics_server.start()
+        except OSError as e:
+            log.error("Unable to serve metrics on port {0}: {1}".format(
+                self.metrics_server.port, e))
+
+    async def join_voice_channel(self, channel, *, timeout=15):
         if isinstance(channel, discord.Object):
             channel = self.get_channel(channel.id)
 
@@ -174,6 +357,8 @@ class VitasBot(discord.Client):
                     server.name
                 ))
 
+        await self.ensure_opus()
+
         def session_id_found(data):
             user_id = data.get("user_id")
             guild_id = data.get("guild_id")
@@ -184,14 +369,22 @@ class VitasBot(discord.Client):
         session_id_future = self.ws.wait_for('VOICE_STATE_UPDATE', session_id_found)
         voice_data_future = self.ws.wait_for('VOICE_SERVER_UPDATE', lambda d: d.get('guild_id') == server.id)
 
+        # Timed from the voice state update, so a slow gateway reply counts
+        started = time.perf_counter()
+
         log.debug("({0}) Setting voice state".format(__func__()))
         await self.ws.voice_state(server.id, channel.id)
 
-        log.debug("({0}) Waiting for session id".format(__func__()))
-        session_id_data = await asyncio.wait_for(session_id_future, timeout=15, loop=self.loop)
+        try:
+            log.debug("({0}) Waiting for session id".format(__func__()))
+            session_id_data = await asyncio.wait_for(session_id_future, timeout=timeout, loop=self.loop)
 
-        log.debug("({0}) Waiting for voice data".format(__func__()))
-        data = await asyncio.wait_for(voice_data_future, timeout=15, loop=self.loop)
+            log.debug("({0}) Waiting for voice data".format(__func__()))
+            data = await asyncio.wait_for(voice_data_future, timeout=timeout, loop=self.loop)
+        except asyncio.TimeoutError:
+            self.metrics.voice_connect.observe(time.perf_counter() - started,
+                result="timeout")
+            raise
 
         kwargs ={
             "user": self.user,
@@ -207,13 +400,15 @@ class VitasBot(discord.Client):
         try:
             log.debug("({0}) Connecting...".format(__func__()))
             
-            with aiohttp.Timeout(15):
+            with aiohttp.Timeout(timeout):
                 await voice.connect()
         except asyncio.TimeoutError as e:
+            self.metrics.voice_connect.observe(time.perf_counter() - started,
+                result="timeout")
             log.debug("({0}) Connection failed, disconnecting...".format(__func__()))
 
             try:
-                await voice.disconenct()
+                await voice.disconnect()
             except:
                 pass
 
@@ -221,11 +416,115 @@ class VitasBot(discord.Client):
 
             raise e
 
+        self.metrics.voice_connect.observe(time.perf_counter() - started, result="ok")
         log.debug("({0}) Connected successfully".format(__func__()))
 
         self.connection._add_voice_client(server.id, voice)
         return voice
 
+    def open_source(self, track, volume=1.0, offset=0.0):
+        gain = self.library.gain(track)
+
+        if self.opus_cache:
+            # Encoded frames cannot be volume scaled
+            cached = self.opus_cache.get(track, gain) if volume == 1.0 else None
+
+            if cached:
+                return OpusFrameReader(cached, start=int(offset * 1000 / FRAME_LENGTH))
+
+            if self.config.opus_cache_on_play:
+                self.opus_cache.request(track, gain)
+
+        volume *= 10 ** (gain / 20)
+        seek = "-ss {0:.2f}".format(offset) if offset else None
+
+        if self.audio_workers is not None:
+            return self.audio_workers.open(track.path, volume=volume,
+                before_options=seek, options="-nostats")
+
+        return FFmpegSource(track.path, before_options=seek, options="-nostats",
+            volume=volume)
+
+    def create_player(self, channel, voice, volume=1.0, start_at=0.0):
+        server = channel.server
+
+        # Both callbacks run on the player thread and must not touch the loop
+        player = GuildPlayer(voice, self.open_source, volume=volume,
+            prefetch_frames=self.config.prefetch_frames,
+            on_track=lambda track: self._post_player_event(
+                PLAYER_TRACK_STARTED, server, player, track),
+            after=lambda: self._post_player_event(
+                PLAYER_FINISHED, server, player),
+            stats=self.voice_stats.setdefault(server.id, FrameStats()),
+            start_at=start_at)
+
+        self.players[server.id] = player
+        return player
+
+    def _post_player_event(self, event, server, player, track=None):
+        self.loop.call_soon_threadsafe(self.player_events.put_nowait,
+            (event, server, player, track))
+
+    async def _player_supervisor(self):
+        while True:
+            events = [await self.player_events.get()]
+
+            # Handle everything that finished at the same time in one go
+            while not self.player_events.empty():
+                events.append(self.player_events.get_nowait())
+
+            for event, server, player, track in events:
+                # The server may have a new player by the time we get here
+                if self.players.get(server.id) is not player:
+                    continue
+
+                if event == PLAYER_TRACK_STARTED:
+                    log.info("Now playing: {0}".format(track.title))
+                    self.now_playing[server.id] = track
+                    self.presence.set_playing(server.id, track.title,
+                        is_paused=not player.is_playing())
+                elif event == PLAYER_FINISHED:
+                    self.remove_player(server)
+
+                    if player.disconnected:
+                        self.sessions.interrupt(server, player)
+
+                    if player.error is not None:
+                        log.error("Player on {0} stopped: {1}".format(
+                            server.name, player.error))
+
+    def start_broadcast(self, track):
+        self.stop_broadcast()
+
+        broadcast = Broadcast(self.open_source(track), track,
+            buffer_frames=self.config.broadcast_buffer_frames,
+            after=lambda: self.loop.call_soon_threadsafe(
+                self._broadcast_finished, broadcast))
+
+        for voice in self.voice_clients:
+            if voice.server.id not in self.players:
+                broadcast.subscribe(voice)
+
+        self.broadcast = broadcast
+        self.presence.set_playing(BROADCAST_KEY, track.title)
+        broadcast.start()
+        return broadcast
+
+    def stop_broadcast(self):
+        if self.broadcast is not None:
+            self.broadcast.stop()
+            self.broadcast = None
+            self.presence.clear(BROADCAST_KEY)
+
+    def leave_broadcast(self, server):
+        if self.broadcast is not None:
+            self.broadcast.unsubscribe(server.id)
+
+    def _broadcast_finished(self, broadcast):
+        if self.broadcast is broadcast:
+            self.broadcast = None
+            self.presence.clear(BROADCAST_KEY)
+
     async def get_player(self, channel):
         server = channel.server
 
@@ -237,37 +536,50 @@ class VitasBot(discord.Client):
         return self.players[server.id]
 
     async def on_message(self, message):
+        # Most traffic is not for us, so reject it before doing anything else
+        self.metrics.messages.inc()
+        message_content = message.content.strip()
+
+        if not message_content.startswith(self.config.command_prefix):
+            self.ignored_messages["prefix"] += 1
+            return
+
         await self.wait_until_ready()
 
         if message.author == self.user:
-            log.warning("Ignoring messages from myself: {0}".format(
-                message.content))
+            self.ignored_messages["self"] += 1
             return
 
-        if message.author.id not in self.config.owner_id:
-            log.warning("Ignoring messages from user ({0}/{1}#{2}): {3}".format(
-                message.author.id, message.author.name, message.author.discriminator,
-                message.content))
+        if not self.is_owner(message.author):
+            self.ignored_messages["not_owner"] += 1
+            self.ignored_log.log(logging.WARNING,
+                "Ignoring messages from user (%s/%s#%s): %s",
+                message.author.id, message.author.name,
+                message.author.discriminator, message_content)
             return
 
-        message_content = message.content.strip()
+        args = split_args(message_content[len(self.config.command_prefix):])
 
-        if not message_content.startswith(self.config.command_prefix):
+        if not args:
             return
 
-        command, *args = message_content.split(' ')
-        command = command[len(self.config.command_prefix):].lower().strip()
-
-        handler = getattr(self.commands, "cmd_" + command, None)
+        command = self.commands.get(args[0].lower())
 
-        if not handler:
+        if not command:
+            self.ignored_messages["unknown_command"] += 1
             return
 
-        msg = None
-
-        args.insert(0, message.channel)
+        started = time.perf_counter()
 
-        msg = await handler(*args)
+        try:
+            msg = await command(message.channel, args[1:])
+        except Exception as e:
+            self.metrics.command_errors.inc(command=command.name, type=type(e).__name__)
+            raise
+        finally:
+            self.metrics.command_duration.observe(time.perf_counter() - started,
+                command=command.name)
+            self.startup.command_handled()
 
         #kwargs = {
         #    "tts": False,
@@ -284,18 +596,32 @@ class VitasBot(discord.Client):
         quiet = kwargs.pop("quiet", False)
         expire_in = kwargs.pop("expire_in", 0)
 
+        if content is None:
+            return None
+
+        return await self.sender.send(dest, content, tts=tts, expire_in=expire_in)
+
+    async def send_message_now(self, dest, content, *, tts=False, expire_in=0):
         msg = None
+        started = time.perf_counter()
 
         try:
-            if content is not None:
-                msg = await self.send_message(dest, content, tts=tts)
+            msg = await self.send_message(dest, content, tts=tts)
         except discord.Forbidden:
+            self.metrics.send_errors.inc(type="Forbidden")
             log.error("Unable to send message to {0}, no permission".format(
                 dest.name))
         except discord.NotFound:
+            self.metrics.send_errors.inc(type="NotFound")
             log.error("Unable to send message to {0}, invalid channel?".format(
                 dest.name))
-        except discord.HTTPException:
+        except discord.HTTPException as e:
+            status = getattr(e.response, "status", None)
+            self.metrics.send_errors.inc(type="HTTP {0}".format(status))
+
+            if status == 429:
+                self.sender.rate_limited += 1
+
             if len(content) > DISCORD_MSG_CHAR_LIMIT:
                 log.error("Message over the size limit {0}/{1}".format(
                     len(content), DISCORD_MSG_CHAR_LIMIT))
@@ -305,8 +631,10 @@ class VitasBot(discord.Client):
                     dest.name, content
                 ))
         finally:
+            self.metrics.send_duration.observe(time.perf_counter() - started)
+
             if msg and expire_in:
-                asyncio.ensure_future(self._wait_delete_msg(msg, expire_in))
+                self.scheduler.delete_later(msg, expire_in)
 
         return msg
 
@@ -320,11 +648,52 @@ class VitasBot(discord.Client):
             log.error("Unable to send message {0}, invalid channel?".format(
                 msg.clean_content))
 
-    async def _wait_delete_msg(self, msg, after):
-        await asyncio.sleep(after)
-        await self.safe_delete_message(msg)
+    def _can_manage_messages(self, channel_id):
+        # Bulk deletes need Manage Messages, even for the bot's own messages
+        channel = self.get_channel(channel_id)
+
+        if channel is None or channel.is_private:
+            return False
+
+        return channel.permissions_for(channel.server.me).manage_messages
+
+    async def delete_message_ids(self, channel_id, message_ids):
+        bulk = []
+
+        if self.user.bot and self._can_manage_messages(channel_id):
+            bulk = [i for i in message_ids if bulk_deletable(i)]
+
+        if len(bulk) < 2:
+            bulk = []
+
+        single = [i for i in message_ids if i not in bulk]
+
+        if bulk:
+            try:
+                await self.http.delete_messages(channel_id, bulk)
+            except discord.HTTPException as e:
+                log.warning("Bulk delete failed, deleting one by one: {0}".format(e))
+                single = list(message_ids)
+
+        for message_id in single:
+            try:
+                await self.http.delete_message(channel_id, message_id)
+            except discord.NotFound:
+                pass
+            except discord.Forbidden:
+                log.error("Unable to delete message {0}, no permission".format(
+                    message_id))
 
     async def on_ready(self):
+        # Only the first READY is part of starting up, not reconnects
+        first = self.startup.since("gateway") is not None
+
+        with self.startup.phase("on_ready"):
+            self.members.rebuild(self.servers)
+
+        self.loop.create_task(self.sessions.restore())
+        self.loop.create_task(self._update_nicknames())
+
         log.info("Bot:   {0}/{1}#{2}{3}".format(
                 self.user.id,
                 self.user.name,
@@ -332,12 +701,8 @@ class VitasBot(discord.Client):
                 " [BOT]" if self.user.bot else " [UserBOT]"
         ))
 
-        if type(self.config.owner_id) is not list:
-            self.config.owner_id = [self.config.owner_id]
-
-        for i, s in enumerate(self.config.owner_id):
-            self.config.owner_id[i] = s.strip()
-            owner = self._get_member_from_id(self.config.owner_id[i])
+        for owner_id in sorted(self.config.owner_id):
+            owner = self._get_member_from_id(owner_id)
 
             if owner and self.servers:
                 log.info("Owner: {0}/{1}#{2}".format(
@@ -345,61 +710,80 @@ class VitasBot(discord.Client):
                     owner.name,
                     owner.discriminator
                 ))
-
-                log.info("Server list:")
-                [log.info(" - {0}".format(s.name)) for s in self.servers]
             elif self.servers:
                 log.info("Owner could not be found on any server (id: {0})".format(
                     owner_id
                 ))
-
-                log.info("Server list:")
-                [log.info(" - {0}".format(s.name)) for s in self.servers]
             else:
                 log.info("Owner unknown, bot is not on any servers")
 
-        bot_member = self._get_member_from_id(self.user.id)
+        if self.servers:
+            servers = sorted(s.name for s in self.servers)
+            log.info("Server list:")
+            [log.info(" - {0}".format(name)) for name in servers[:SERVER_LIST_LIMIT]]
 
-        if bot_member.nick != self.config.nickname:
-            log.info("Changing nickname to {0}".format(self.config.nickname))
-            await self.change_nickname(bot_member, nickname=self.config.nickname)
+            if len(servers) > SERVER_LIST_LIMIT:
+                log.info(" ... and {0} more".format(len(servers) - SERVER_LIST_LIMIT))
 
-    def remove_player(self, channel):
-        try:
-            self.players.pop(channel.server.id)
+        if first:
+            log.info("Started in {0:.2f}s ({1})".format(self.startup.elapsed(),
+                self.startup.summary()))
 
-            if channel.server.id in self.now_playing:
-                self.now_playing.pop(channel.server.id)
+    async def _update_nicknames(self):
+        members = [s.me for s in self.servers
+                   if s.me is not None and s.me.nick != self.config.nickname]
 
-                coro = self.change_presence(game=None,
-                    status=discord.Status.online, afk=False)
+        if not members:
+            return
 
-                self.loop.run_until_complete(coro)
-        except:
-            pass
-        finally:
-            self.loop.close()
+        log.info("Changing nickname to {0} on {1} servers".format(
+            self.config.nickname, len(members)))
+        semaphore = asyncio.Semaphore(NICKNAME_CONCURRENCY, loop=self.loop)
+
+        async def change(member):
+            async with semaphore:
+                try:
+                    await self.change_nickname(member, nickname=self.config.nickname)
+                except discord.HTTPException as e:
+                    log.warning("Unable to change nickname on {0}: {1}".format(
+                        member.server.name, e))
+
+        with self.startup.phase("nicknames"):
+            await asyncio.gather(*[change(m) for m in members], loop=self.loop)
+
+    async def on_member_join(self, member):
+        self.members.add(member)
+
+    async def on_member_remove(self, member):
+        self.members.remove(member)
+
+    async def on_member_update(self, before, after):
+        self.members.add(after)
+
+    async def on_server_join(self, server):
+        self.members.add_server(server)
+
+    async def on_server_available(self, server):
+        self.members.add_server(server)
+
+    async def on_server_remove(self, server):
+        self.members.remove_server(server)
+        self.voice_stats.pop(server.id, None)
+
+    def stats_snapshot(self):
+        return {
+            "ignored_messages": dict(self.ignored_messages),
+            "voice": {k: v.to_dict() for k, v in self.voice_stats.items()},
+            "loop": self.watchdog.to_dict() if self.watchdog else None,
+            "voice_connections": self.voice_manager.to_dict(),
+            "shard": self.shard_id,
+            "startup": self.startup.to_dict(),
+            "logging": self.log_pipeline.to_dict() if self.log_pipeline else None,
+            "cluster": self.shard_link.cluster if self.shard_link else None
+        }
+
+    def remove_player(self, server):
+        self.now_playing.pop(server.id, None)
+        self.presence.clear(server.id)
+        return self.players.pop(server.id, None)
 
-    async def update_playing_presence(self, song=None, is_paused=False):
-        game = None
-
-        if self.user.bot:
-            active_players = sum(1 for p in self.players.values() if p.is_playing())
-
-            if active_players > 1:
-                game = discord.Game(name="music on {0} servers".format(
-                    active_players))
-                song = None
-            elif active_players == 1:
-                player = discord.utils.get(self.players.values(), is_playing=True)
-                # TODO: Get song from player
-
-        if song:
-            prefix = u"\u275A\u275A " if is_paused else u"\u25B6 "
-            name = "{0}{1}".format(prefix, song)[:128]
-            game = discord.Game(name=name)
-
-        async with self.aiolocks[__func__()]:
-            if game != self.last_status:
-                await self.change_presence(game=game)
-                self.last_status = game
\ No newline at end of file
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import logging
+import threading
+
+from collections import deque
+
+from discord import opus
+
+from .player import FRAME_LENGTH
+from .opuscache import SAMPLING_RATE, CHANNELS
+
+log = logging.getLogger(__name__)
+
+class Subscriber(threading.Thread):
+    def __init__(self, voice, buffer_frames):
+        super().__init__(name="Broadcast-{0}".format(voice.server.id), daemon=True)
+        self.voice = voice
+        self.frames = deque(maxlen=buffer_frames)
+        self.dropped = 0
+        self._wake = threading.Event()
+        self._end = threading.Event()
+
+    def push(self, frame):
+        # Never blocks: a full ring drops its oldest frame
+        if len(self.frames) == self.frames.maxlen:
+            self.dropped += 1
+
+        self.frames.append(frame)
+        self._wake.set()
+
+    def run(self):
+        while not self._end.is_set():
+            self._wake.wait()
+            self._wake.clear()
+
+            while self.frames and not self._end.is_set():
+                if not self.voice.is_connected():
+                    self.stop()
+                    break
+
+                try:
+                    frame = self.frames.popleft()
+                except IndexError:
+                    break
+
+                try:
+                    self.voice.play_audio(frame, encode=False)
+                except Exception:
+                    log.exception("Failed to send broadcast to {0}".format(
+                        self.voice.server.name))
+                    self.stop()
+
+    def stop(self):
+        self._end.set()
+        self._wake.set()
+
+    def is_done(self):
+        return self._end.is_set()
+
+class Broadcast(threading.Thread):
+    # Produces each opus frame once and fans it out to every subscribed
+    # voice client. A slow subscriber only loses frames from its own ring.
+
+    def __init__(self, source, track, *, buffer_frames=50, after=None):
+        super().__init__(name="Broadcast", daemon=True)
+        self.source = source
+        self.track = track
+        self.buffer_frames = buffer_frames
+        self.after = after
+        self.delay = FRAME_LENGTH / 1000.0
+
+        self._encoder = None if source.encoded else opus.Encoder(SAMPLING_RATE, CHANNELS)
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._end = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def __contains__(self, server_id):
+        return server_id in self._subscribers
+
+    def subscribe(self, voice):
+        subscriber = Subscriber(voice, self.buffer_frames)
+
+        with self._lock:
+            previous = self._subscribers.pop(voice.server.id, None)
+            self._subscribers[voice.server.id] = subscriber
+
+        if previous:
+            previous.stop()
+
+        subscriber.start()
+        return subscriber
+
+    def unsubscribe(self, server_id):
+        with self._lock:
+            subscriber = self._subscribers.pop(server_id, None)
+
+        if subscriber:
+            subscriber.stop()
+
+        return subscriber
+
+    def run(self):
+        try:
+            self._do_run()
+        except Exception:
+            log.exception("Broadcast of {0} failed".format(self.track))
+        finally:
+            self.source.close()
+
+            with self._lock:
+                subscribers, self._subscribers = self._subscribers, {}
+
+            for subscriber in subscribers.values():
+                subscriber.stop()
+
+            if self.after is not None:
+                try:
+                    self.after()
+                except Exception:
+                    log.exception("Calling the after function failed")
+
+    def _do_run(self):
+        loops = 0
+        start = time.time()
+
+        while not self._end.is_set():
+            if not self._resumed.is_set():
+                self._resumed.wait()
+                loops = 0
+                start = time.time()
+
+            data = self.source.read()
+
+            if not data:
+                break
+
+            if self._encoder is not None:
+                data = self._encoder.encode(data, self._encoder.samples_per_frame)
+
+            with self._lock:
+                subscribers = list(self._subscribers.items())
+
+            for server_id, subscriber in subscribers:
+                if not subscriber.is_done():
+                    subscriber.push(data)
+                    continue
+
+                with self._lock:
+                    if self._subscribers.get(server_id) is subscriber:
+                        del self._subscribers[server_id]
+
+            loops += 1
+            next_time = start + self.delay * loops
+            time.sleep(max(0, next_time - time.time()))
+
+    def stop(self):
+        self._end.set()
+        self._resumed.set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def is_playing(self):
+        return self._resumed.is_set() and not self.is_done()
+
+    def is_done(self):
+        return self._end.is_set() or not self.is_alive()
@@ -24,21 +24,169 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import os
+import io
+import json
+import math
 import time
-import random
+import shlex
+import inspect
 import logging
 
-from discord import Game
-from discord import Status
-
 from textwrap import dedent
 
+from discord.enums import ChannelType
+
+from .profiler import sample_stacks, format_collapsed
+
 log = logging.getLogger(__name__)
 
+MAX_PROFILE_SECONDS = 60
+
+def aliases(*names):
+    def decorator(func):
+        func.aliases = names
+        return func
+
+    return decorator
+
+def split_args(text):
+    try:
+        return shlex.split(text)
+    except ValueError:
+        # Unbalanced quotes, e.g. an apostrophe in a song title
+        return text.split()
+
+class Command:
+    def __init__(self, name, handler, command_prefix):
+        self.name = name
+        self.handler = handler
+        self.aliases = getattr(handler, "aliases", ())
+        self.help = "```{0}```".format(dedent(handler.__doc__ or "").format(
+            command_prefix=command_prefix))
+
+        self.params = []
+        self.varargs = False
+
+        # The first parameter is always the channel the command came from
+        for param in list(inspect.signature(handler).parameters.values())[1:]:
+            if param.kind == param.VAR_POSITIONAL:
+                self.varargs = True
+                continue
+
+            # A number without a default of its own is annotated instead
+            default = param.default
+            converter = type(default) if type(default) in (int, float) else None
+
+            if param.annotation in (int, float):
+                converter = param.annotation
+            self.params.append((param.name, converter, default))
+
+    def _keyword(self, arg):
+        # name=value, where name may be shortened to three letters (vol=0.5)
+        key, sep, value = arg.partition("=")
+        key = key.lower()
+
+        if sep and len(key) >= 3:
+            for name, converter, default in self.params:
+                if name.startswith(key):
+                    return name, value
+
+        return None, None
+
+    @staticmethod
+    def _convert(name, converter, value):
+        try:
+            converted = converter(value) if converter is not None else value
+        except ValueError:
+            converted = None
+
+        if converted is None or (isinstance(converted, float) and
+                                 not math.isfinite(converted)):
+            raise Exception("Invalid value for {0}: {1}".format(name, value))
+
+        return converted
+
+    def parse(self, args):
+        parsed = []
+        args = list(args)
+        keywords = {}
+
+        while args:
+            name, value = self._keyword(args[0])
+
+            if name is None:
+                break
+
+            keywords[name] = value
+            args.pop(0)
+
+        for name, converter, default in self.params:
+            if name in keywords:
+                parsed.append(self._convert(name, converter, keywords.pop(name)))
+                continue
+
+            # An optional number in front of free text, like the volume of
+            # play, is only taken as name=value, so a title may start with
+            # a number
+            optional = default is not inspect.Parameter.empty
+
+            if not args or (converter is not None and optional and self.varargs):
+                if not keywords and not self.varargs:
+                    break
+
+                if not optional:
+                    raise Exception("Missing value for {0}, see {1}".format(
+                        name, self.help))
+
+                parsed.append(default)
+                continue
+
+            parsed.append(self._convert(name, converter, args.pop(0)))
+
+        if args and not self.varargs:
+            raise Exception("Too many arguments, see {0}".format(self.help))
+
+        return parsed + args
+
+    async def __call__(self, channel, args):
+        return await self.handler(channel, *self.parse(args))
+
 class Commands:
     def __init__(self, bot):
         self.bot = bot
+        self.registry = {}
+
+        prefix = self.bot.config.command_prefix or ""
+
+        for attr in dir(self):
+            if not attr.startswith("cmd_"):
+                continue
+
+            command = Command(attr[len("cmd_"):].lower(), getattr(self, attr), prefix)
+            self.registry[command.name] = command
+
+            for alias in command.aliases:
+                self.registry[alias] = command
+
+        names = []
+
+        for name, command in sorted(self.registry.items()):
+            if name != command.name:
+                continue
+
+            line = "{0}{1}".format(prefix, name)
+
+            if command.aliases:
+                line += " ({0})".format(", ".join("{0}{1}".format(prefix, a) for a in command.aliases))
+
+            names.append(line)
+
+        self.help_text = "**Available commands**\n```{0}```\n" \
+            "You can also use `{1}help x` for more info about each command.".format(
+            "\n".join(names), prefix)
+
+    def get(self, name):
+        return self.registry.get(name)
 
     async def cmd_help(self, channel, command=None):
         """
@@ -49,32 +197,13 @@ class Commands:
         If a command is specified, a personalised help message is printed
         for that command. Otherwise, all available commands are listed.
         """
-        
-        msg = None
-
-        if command:
-            cmd = getattr(self, "cmd_" + command, None)
-
-            if cmd:
-                msg = "```{0}```".format(dedent(cmd.__doc__)).format(
-                    command_prefix=self.bot.config.command_prefix)
-            else:
-                msg = "No such command"
-        else:
-            msg = "**Available commands**\n```"
-            commands = []
 
-            for func in dir(self):
-                if func.startswith("cmd_"):
-                    cmd_name = func.replace("cmd_", "").lower()
-                    commands.append("{0}{1}".format(self.bot.config.command_prefix, cmd_name))
+        if not command:
+            return self.help_text
 
-            msg += "\n".join(commands)
-            msg += "```\nYou can also use `{0}help x` for more info about each command.".format(
-                self.bot.config.command_prefix
-            )
+        cmd = self.registry.get(command.lower())
 
-        return msg
+        return cmd.help if cmd else "No such command"
 
     async def cmd_join(self, channel, channel_id=None):
         """
@@ -86,65 +215,182 @@ class Commands:
         Join voice channel on servers the bot is affiliated with.
         """
 
-        voice = self.bot.voice_client_in(channel.server)
-
         if channel_id is None:
             channel_id = self.bot.config.channel_id
 
-        if voice is not None:
-            if channel.server.id in self.bot.players:
-                player = self.bot.players.pop(channel.server.id)
-                player.stop()
-
-            if channel.server.id in self.bot.now_playing:
-                self.bot.now_playing.pop(channel.server.id)
+        # An existing connection is kept, or moved to the new channel
+        channel = self.bot.get_channel(str(channel_id))
 
-                await self.bot.change_presence(game=None,
-                    status=Status.online, afk=False)
-                    
-            await voice.disconnect()
+        if channel is None or channel.type != ChannelType.voice:
+            return "No voice channel with the id {0}".format(channel_id)
 
-        channel = self.bot.get_channel(str(channel_id))
-        voice = await self.bot.join_voice_channel(channel)
+        await self.bot.voice_manager.connect(channel)
 
-    async def cmd_play(self, channel, volume=1.0, song=None):
+    async def cmd_play(self, channel, volume: float=None, *song):
         """
         Usage:
-            {command_prefix}play [*volume] [*song]
+            {command_prefix}play [*vol=volume] [*song]
 
         * = Optional argument
 
-        Play song stored on the bot.
+        Play song stored on the bot, or queue it if a song is already playing.
+        The song does not need to be an exact filename, the closest match
+        in the library is played, e.g. {command_prefix}play vitas 7th element
+        The volume goes from 0.0 to 2.0, e.g. {command_prefix}play vol=0.5 vitas
+        and when a song is queued it changes the song playing now as well
         Note: If song is not specified, the bot will pick a song to play 
         from random in the songs directory specified in the configuration
+        Songs in the opus cache are only used at volume 1.0
         """
-        
-        # Pick a random song from the folder
-        if song is None:
-            songs = [i for i in os.listdir(self.bot.config.music_dir)]
-            song = random.choice(songs)
+
+        # Pick a random song from the library
+        if not song:
+            track = self.bot.library.random_track()
+        else:
+            track = self.bot.library.find(" ".join(song))
+
+        if track is None:
+            if not self.bot.library.ready.is_set():
+                raise Exception("The music library is still being indexed")
+
+            raise Exception("No such song")
 
         voice = self.bot.voice_client_in(channel.server)
 
-        if voice is not None:
-            if channel.server.id not in self.bot.players:
-                path = self.bot.config.music_dir + os.path.sep + song
-                filename, file_extension = os.path.splitext(path)
-                now_playing = "Now playing: {}".format(filename)
-                log.info(now_playing)
-                await self.bot.update_playing_presence(song)
-
-                self.bot.players[channel.server.id] = voice.create_ffmpeg_player(path,
-                    before_options="-re", options="-nostats -loglevel 0",
-                    after=lambda: self.bot.remove_player(channel))
-                self.bot.players[channel.server.id].volume = float(volume)
-                self.bot.now_playing[channel.server.id] = song
-                self.bot.players[channel.server.id].start()
-            else:
-                raise Exception("Bot is already playing in voice channel")
+        if voice is None:
+            raise Exception("The bot is not part of a voice channel")
+
+        player = self.bot.players.get(channel.server.id)
+
+        if player is not None and not player.is_done():
+            position = player.enqueue(track)
+
+            # The volume belongs to the player, so it changes right away
+            if volume is not None:
+                player.volume = volume
+                return "Queued {0} at position {1}, volume set to {2:.2f}".format(
+                    track.title, position, player.volume)
+
+            return "Queued {0} at position {1}".format(track.title, position)
+
+        self.bot.leave_broadcast(channel.server)
+
+        player = self.bot.create_player(channel, voice,
+            volume=1.0 if volume is None else volume)
+        player.enqueue(track)
+        player.start()
+
+    async def cmd_skip(self, channel):
+        """
+        Usage:
+            {command_prefix}skip
+
+        Skips to the next song in the queue.
+        """
+
+        if channel.server.id not in self.bot.players:
+            raise Exception("Bot is not playing in this server")
+
+        self.bot.players[channel.server.id].skip()
+
+    async def cmd_shuffle(self, channel):
+        """
+        Usage:
+            {command_prefix}shuffle
+
+        Shuffles the songs waiting in the queue.
+        """
+
+        if channel.server.id not in self.bot.players:
+            raise Exception("Bot is not playing in this server")
+
+        self.bot.players[channel.server.id].shuffle()
+
+    async def cmd_queue(self, channel):
+        """
+        Usage:
+            {command_prefix}queue
+
+        Lists the songs waiting in the queue.
+        """
+
+        if channel.server.id not in self.bot.players:
+            raise Exception("Bot is not playing in this server")
+
+        player = self.bot.players[channel.server.id]
+        upcoming = player.upcoming()
+
+        lines = ["**Now playing:** {0}".format(player.current)]
+        lines += ["{0}. {1}".format(i, t) for i, t in enumerate(upcoming[:20], 1)]
+
+        if len(upcoming) > 20:
+            lines.append("... and {0} more".format(len(upcoming) - 20))
+
+        if player.last_gap is not None:
+            lines.append("Last track change: {0:.1f}ms".format(player.last_gap * 1000))
+
+        return "\n".join(lines)
+
+    async def cmd_broadcast(self, channel, *song):
+        """
+        Usage:
+            {command_prefix}broadcast [*song]
+
+        * = Optional argument
+
+        Play a song on every server where the bot is in a voice channel and
+        not already playing. The song is decoded and encoded only once.
+        Note: If song is not specified, a random song is broadcast
+        """
+
+        if not song:
+            track = self.bot.library.random_track()
         else:
+            track = self.bot.library.find(" ".join(song))
+
+        if track is None:
+            raise Exception("No such song")
+
+        await self.bot.ensure_opus()
+        broadcast = self.bot.start_broadcast(track)
+        log.info("Broadcasting: {0}".format(track.title))
+
+        return "Broadcasting {0} to {1} servers".format(track.title, len(broadcast))
+
+    async def cmd_broadcast_stop(self, channel):
+        """
+        Usage:
+            {command_prefix}broadcast_stop
+
+        Stops the current broadcast on every server.
+        """
+
+        if self.bot.broadcast is None:
+            raise Exception("Bot is not broadcasting")
+
+        self.bot.stop_broadcast()
+
+    async def cmd_listen(self, channel):
+        """
+        Usage:
+            {command_prefix}listen
+
+        Tunes the voice channel on this server in to the current broadcast.
+        """
+
+        voice = self.bot.voice_client_in(channel.server)
+
+        if voice is None:
             raise Exception("The bot is not part of a voice channel")
 
+        if self.bot.broadcast is None:
+            raise Exception("Bot is not broadcasting")
+
+        if channel.server.id in self.bot.players:
+            raise Exception("Bot is already playing in voice channel")
+
+        self.bot.broadcast.subscribe(voice)
+
     async def cmd_pause(self, channel):
         """
         Usage:
@@ -157,9 +403,10 @@ class Commands:
             player = self.bot.players[channel.server.id]
             if player.is_playing():
                 player.pause()
-                await self.bot.update_playing_presence(
-                    song=self.bot.now_playing[channel.server.id],
-                    is_paused=True)
+
+                if player.current is not None:
+                    self.bot.presence.set_playing(channel.server.id,
+                        player.current.title, is_paused=True)
         else:
             raise Exception("Bot is not playing in this server")
 
@@ -175,9 +422,10 @@ class Commands:
             player = self.bot.players[channel.server.id]
             if not player.is_playing():
                 player.resume()
-                await self.bot.update_playing_presence(
-                    song=self.bot.now_playing[channel.server.id],
-                    is_paused=False)
+
+                if player.current is not None:
+                    self.bot.presence.set_playing(channel.server.id,
+                        player.current.title, is_paused=False)
         else:
             raise Exception("Bot is not playing in this server")
 
@@ -190,13 +438,8 @@ class Commands:
         """
 
         if channel.server.id in self.bot.players:
-            player = self.bot.players.pop(channel.server.id)
+            player = self.bot.remove_player(channel.server)
             player.stop()
-
-            if channel.server.id in self.bot.now_playing:
-                self.bot.now_playing.pop(channel.server.id)
-
-                await self.bot.update_playing_presence()
         else:
             raise Exception("Bot is not playing in this server")
 
@@ -211,16 +454,14 @@ class Commands:
         voice = self.bot.voice_client_in(channel.server)
 
         if voice is not None:
-            if channel.server.id in self.bot.players:
-                player = self.bot.players.pop(channel.server.id)
-                player.stop()
+            self.bot.leave_broadcast(channel.server)
 
-            if channel.server.id in self.bot.now_playing:
-                self.bot.now_playing.pop(channel.server.id)
+            player = self.bot.remove_player(channel.server)
 
-                await self.bot.update_playing_presence()
+            if player is not None:
+                player.stop()
 
-            await voice.disconnect()
+            await self.bot.voice_manager.disconnect(channel.server)
         else:
             raise Exception("Bot is not in any voice channels on this server")
 
@@ -232,13 +473,62 @@ class Commands:
         Posts a fabulous picture of the one and only Vitas
         """
 
-        exts = [".jpg", ".jpeg", ".gif", ".gifv", ".png", ".webm"]
-        images = [i for i in os.listdir(self.bot.config.pictures_dir)]
+        picture = self.bot.pictures.random_picture()
+
+        if picture is None:
+            return "No pictures found"
+
+        digest = await self.bot.loop.run_in_executor(None,
+            self.bot.pictures.digest, picture)
+        url = self.bot.picture_cache.get(digest)
+
+        # Discord embeds a posted attachment URL, so a picture uploaded
+        # before only needs its link sent
+        if url:
+            return url
+
+        variants = self.bot.picture_variants
+        path = picture.path
+
+        if variants is not None:
+            path = variants.best(picture)
+            queued = variants.request(picture)
+
+            if path is None:
+                if queued:
+                    return "That picture is too large to upload, a smaller copy is being made"
+
+                return "That picture is too large to upload"
 
-        image = random.choice(images)
+        msg = await self.bot.send_file(channel, path)
 
-        await self.bot.send_file(channel, self.bot.config.pictures_dir + os.path.sep + image)
-        return
+        if msg.attachments:
+            cache = self.bot.picture_cache
+            cache.put(digest, msg.attachments[0]["url"])
+
+            # Written off the loop, from a copy of the entries taken on it
+            try:
+                await self.bot.loop.run_in_executor(None, cache.save, cache.entries())
+            except OSError as e:
+                log.error("Unable to save picture cache: {0}".format(e))
+
+    async def cmd_profile(self, channel, seconds=10.0):
+        """
+        Usage:
+            {command_prefix}profile [seconds]
+
+        Samples what every thread of the bot is doing for the given number
+        of seconds (at most 60) and uploads the stacks in the collapsed
+        format read by flamegraph.pl.
+        """
+
+        seconds = min(max(seconds, 1.0), MAX_PROFILE_SECONDS)
+        stacks = await self.bot.loop.run_in_executor(None, sample_stacks, seconds)
+        data = format_collapsed(stacks).encode("utf-8")
+
+        await self.bot.send_file(channel, io.BytesIO(data),
+            filename="profile-{0}.folded".format(int(time.time())),
+            content="{0} samples over {1:.0f}s".format(sum(stacks.values()), seconds))
 
     async def cmd_ping(self, channel):
         """
@@ -256,6 +546,31 @@ class Commands:
 
         return msg
 
+    async def cmd_stats(self, channel, output="text"):
+        """
+        Usage:
+            {command_prefix}stats [json]
+
+        Shows counters of the messages the bot has ignored and the audio
+        timing of every server. json gives the same as JSON.
+        """
+
+        if output.lower() == "json":
+            return "```json\n{0}```".format(
+                json.dumps(self.bot.stats_snapshot(), indent=1, sort_keys=True))
+
+        ignored = self.bot.ignored_messages
+        lines = ["Ignored messages: {0}".format(sum(ignored.values()))]
+        lines += ["  {0}: {1}".format(k, v) for k, v in sorted(ignored.items())]
+
+        for server_id, stats in sorted(self.bot.voice_stats.items()):
+            server = self.bot.get_server(server_id)
+            lines.append("Voice on {0}:".format(server.name if server else server_id))
+            lines.append("  {0}".format(stats.summary()))
+
+        return "```{0}```".format("\n".join(lines))
+
+    @aliases("np")
     async def cmd_now_playing(self, channel):
         """
         Usage:
@@ -269,4 +584,12 @@ class Commands:
                 "The bot is not playing any songs"
             )
 
-        return self.bot.now_playing[channel.server.id]
\ No newline at end of file
+        track = self.bot.now_playing[channel.server.id]
+        details = [track.codec, "{0:.1f} MB".format(track.size / (1024 * 1024))]
+
+        if track.duration is not None:
+            minutes, seconds = divmod(int(track.duration), 60)
+            details.insert(0, "{0}:{1:02d}".format(minutes, seconds))
+
+        return "{0} ({1})".format(track.title,
+            ", ".join(d for d in details if d))
\ No newline at end of file
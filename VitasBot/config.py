@@ -28,6 +28,8 @@ import os
 import sys
 import configparser
 
+from .logpipe import parse_sampling
+
 class Config:
     def __init__(self, config_file):
         self.config_file = config_file
@@ -49,31 +51,111 @@ class Config:
             )
 
         self.nickname = config.get("User", "Nickname", fallback=ConfigDefaults.nickname)
+        self.presence_debounce = config.getfloat("User", "PresenceDebounce", fallback=ConfigDefaults.presence_debounce)
+        self.presence_interval = config.getfloat("User", "PresenceInterval", fallback=ConfigDefaults.presence_interval)
         self.token = config.get("Credentials", "Token", fallback=ConfigDefaults.token)
         self.proxy = config.get("Credentials", "Proxy", fallback=ConfigDefaults.proxy)
+        shards = config.get("Credentials", "Shards", fallback=str(ConfigDefaults.shards))
+        self.shards = (os.cpu_count() or 1) if shards.lower() == "auto" else int(shards)
 
-        self.owner_id = config.get("Permissions", "OwnerID", fallback=ConfigDefaults.owner_id)
-
-        if ',' in self.owner_id:
-            self.owner_id = self.owner_id.split(",")
+        owner_id = config.get("Permissions", "OwnerID", fallback="")
+        self.owner_id = frozenset(i.strip() for i in owner_id.split(",") if i.strip())
 
         self.channel_id = config.get("Channel", "ChannelID", fallback=ConfigDefaults.channel_id)
         self.command_prefix = config.get("Channel", "CommandPrefix", fallback=ConfigDefaults.command_prefix)
+        self.channel_message_rate = config.getint("Channel", "MessageRate", fallback=ConfigDefaults.channel_message_rate)
+        self.channel_message_window = config.getfloat("Channel", "MessageWindow", fallback=ConfigDefaults.channel_message_window)
+        self.voice_concurrency = config.getint("Channel", "VoiceConcurrency", fallback=ConfigDefaults.voice_concurrency)
+        self.voice_timeout = config.getfloat("Channel", "VoiceTimeout", fallback=ConfigDefaults.voice_timeout)
+        self.expiry_file = config.get("Channel", "ExpiryFile", fallback=ConfigDefaults.expiry_file)
+        self.session_file = config.get("Channel", "SessionFile", fallback=ConfigDefaults.session_file)
+        self.session_interval = config.getfloat("Channel", "SessionInterval", fallback=ConfigDefaults.session_interval)
         self.volume = config.get("Music", "Volume", fallback=ConfigDefaults.volume)
         self.music_dir = config.get("Music", "Directory", fallback=ConfigDefaults.music_dir)
+        self.music_rescan_interval = config.getfloat("Music", "RescanInterval", fallback=ConfigDefaults.music_rescan_interval)
+        self.music_probe = config.getboolean("Music", "ProbeMetadata", fallback=ConfigDefaults.music_probe)
+        self.normalize = config.getboolean("Music", "NormalizeLoudness", fallback=ConfigDefaults.normalize)
+        self.loudness_target = config.getfloat("Music", "TargetLoudness", fallback=ConfigDefaults.loudness_target)
+        self.library_index = config.get("Music", "LibraryIndex", fallback=ConfigDefaults.library_index)
+        audio_workers = config.get("Music", "AudioWorkers", fallback=str(ConfigDefaults.audio_workers))
+        self.audio_workers = (os.cpu_count() or 1) if audio_workers.lower() == "auto" else int(audio_workers)
+        self.audio_worker_frames = config.getint("Music", "AudioWorkerFrames", fallback=ConfigDefaults.audio_worker_frames)
+        self.opus_cache_dir = config.get("Music", "OpusCacheDirectory", fallback=ConfigDefaults.opus_cache_dir)
+        self.opus_cache_on_play = config.getboolean("Music", "OpusCacheOnPlay", fallback=ConfigDefaults.opus_cache_on_play)
+        self.broadcast_buffer_frames = config.getint("Music", "BroadcastBufferFrames", fallback=ConfigDefaults.broadcast_buffer_frames)
+        self.prefetch_frames = config.getint("Music", "PrefetchFrames", fallback=ConfigDefaults.prefetch_frames)
         self.pictures_dir = config.get("Pictures", "Directory", fallback=ConfigDefaults.pictures_dir)
+        self.picture_rescan_interval = config.getfloat("Pictures", "RescanInterval", fallback=ConfigDefaults.picture_rescan_interval)
+        self.picture_cache_file = config.get("Pictures", "UploadCacheFile", fallback=ConfigDefaults.picture_cache_file)
+        self.picture_cache_size = config.getint("Pictures", "UploadCacheSize", fallback=ConfigDefaults.picture_cache_size)
+        self.picture_cache_ttl = config.getfloat("Pictures", "UploadCacheTTL", fallback=ConfigDefaults.picture_cache_ttl)
+        self.picture_variant_dir = config.get("Pictures", "VariantDirectory", fallback=ConfigDefaults.picture_variant_dir)
+        self.picture_variant_workers = config.getint("Pictures", "VariantWorkers", fallback=ConfigDefaults.picture_variant_workers)
+        self.upload_limit = config.getint("Pictures", "UploadLimit", fallback=ConfigDefaults.upload_limit)
         self.debug_level = config.get("Console", "DebugLevel", fallback=ConfigDefaults.debug_level)
-        self.debug_mode = config.get("Console", "DebugMode", fallback=ConfigDefaults.debug_mode)
+        self.debug_mode = config.getboolean("Console", "DebugMode", fallback=ConfigDefaults.debug_mode)
+        self.debug_log_file = config.get("Console", "DebugLogFile", fallback=ConfigDefaults.debug_log_file)
+        self.log_file = config.get("Console", "LogFile", fallback=ConfigDefaults.log_file)
+        self.log_max_bytes = config.getint("Console", "LogMaxBytes", fallback=ConfigDefaults.log_max_bytes)
+        self.log_rotate_when = config.get("Console", "LogRotateWhen", fallback=ConfigDefaults.log_rotate_when)
+        self.log_backups = config.getint("Console", "LogBackups", fallback=ConfigDefaults.log_backups)
+        self.log_json = config.getboolean("Console", "LogJson", fallback=ConfigDefaults.log_json)
+        self.log_queue_size = config.getint("Console", "LogQueueSize", fallback=ConfigDefaults.log_queue_size)
+        self.log_sampling = parse_sampling(config.get("Console", "LogSampling", fallback=""))
+        self.stall_threshold = config.getfloat("Console", "StallThreshold", fallback=ConfigDefaults.stall_threshold)
+        self.metrics_host = config.get("Console", "MetricsHost", fallback=ConfigDefaults.metrics_host)
+        self.metrics_port = config.getint("Console", "MetricsPort", fallback=ConfigDefaults.metrics_port)
+        self.ignored_log_rate = config.getfloat("Console", "IgnoredLogRate", fallback=ConfigDefaults.ignored_log_rate)
 
 class ConfigDefaults:
     nickname = None
+    presence_debounce = 1.0
+    presence_interval = 12.0
     token = "TOKEN_HERE"
-    owner_id = 000000000000000000
+    shards = 1
+    owner_id = frozenset()
     channel_id = 000000000000000000
     command_prefix = None
+    channel_message_rate = 5
+    channel_message_window = 5.0
+    expiry_file = "cache/expiries.json"
+    session_file = "cache/sessions.json"
+    session_interval = 5.0
+    voice_concurrency = 5
+    voice_timeout = 15.0
     volume = 1.0
     music_dir = "music"
+    music_rescan_interval = 30.0
+    music_probe = True
+    normalize = True
+    loudness_target = -16.0
+    library_index = "cache/library.json"
+    audio_workers = 0
+    audio_worker_frames = 100
+    opus_cache_dir = "cache/opus"
+    opus_cache_on_play = False
+    broadcast_buffer_frames = 50
+    prefetch_frames = 50
     pictures_dir = "pictures"
+    picture_rescan_interval = 30.0
+    picture_cache_file = "cache/pictures.json"
+    picture_cache_size = 256
+    picture_cache_ttl = 604800.0
+    picture_variant_dir = "cache/pictures"
+    picture_variant_workers = 2
+    upload_limit = 8388608
     debug_level = "INFO"
     debug_mode = True
+    debug_log_file = "logs/discord.log"
+    log_file = ""
+    log_max_bytes = 10485760
+    log_rotate_when = ""
+    log_backups = 5
+    log_json = False
+    log_queue_size = 10000
+    log_sampling = {}
+    ignored_log_rate = 1.0
+    stall_threshold = 0.25
+    metrics_host = "127.0.0.1"
+    metrics_port = 9184
     proxy = None
\ No newline at end of file
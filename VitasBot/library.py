@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import json
+import math
+import time
+import random
+import logging
+import threading
+import subprocess
+
+from .search import SearchIndex
+
+log = logging.getLogger(__name__)
+
+# Keep normalised tracks this far below full scale
+PEAK_CEILING = -1.0
+
+class Track:
+    __slots__ = ("name", "path", "size", "mtime", "duration", "codec",
+                 "loudness", "peak")
+
+    def __init__(self, name, path, size, mtime, duration=None, codec=None,
+                 loudness=None, peak=None):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.duration = duration
+        self.codec = codec
+        self.loudness = loudness
+        self.peak = peak
+
+    @property
+    def title(self):
+        return os.path.splitext(self.name)[0]
+
+    def __str__(self):
+        return self.title
+
+    def __repr__(self):
+        return "<Track name={0.name!r} size={0.size} duration={0.duration}>".format(self)
+
+class MusicLibrary:
+    def __init__(self, directory, *, rescan_interval=30, probe=True,
+                 loudness_target=None, index_path=None, analyse=True):
+        self.directory = directory
+        self.rescan_interval = rescan_interval
+        self.probe = probe and analyse
+        self.analyse = analyse
+        self.loudness_target = loudness_target
+        self.index_path = index_path
+        self.ready = threading.Event()
+        self.search_index = SearchIndex()
+
+        self._tracks = {}
+        self._names = []
+        self._positions = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._dir_mtime = None
+        self._index = {}
+        self._index_mtime = None
+        self._unprobed = []
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def __contains__(self, name):
+        return name in self._tracks
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._thread = threading.Thread(target=self._run,
+            name="MusicLibrary", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def get(self, name):
+        return self._tracks.get(name)
+
+    def find(self, query):
+        track = self._tracks.get(query)
+
+        if track is None:
+            for name in self.search_index.search(query):
+                track = self._tracks.get(name)
+
+        return track
+
+    def random_track(self):
+        with self._lock:
+            if not self._names:
+                return None
+
+            return self._tracks[random.choice(self._names)]
+
+    def tracks(self):
+        with self._lock:
+            return list(self._tracks.values())
+
+    def gain(self, track):
+        # Gain in dB that brings the track to the target loudness without
+        # pushing its peak over the ceiling
+        if self.loudness_target is None or track.loudness is None or \
+                not math.isfinite(track.loudness):
+            return 0.0
+
+        gain = self.loudness_target - track.loudness
+
+        if track.peak is not None and math.isfinite(track.peak):
+            gain = min(gain, PEAK_CEILING - track.peak)
+
+        return gain
+
+    def load_index(self):
+        # Metadata and loudness saved by an earlier run, used by rescan for
+        # the songs that have not changed since
+        if not self.index_path:
+            return
+
+        try:
+            self._index_mtime = os.stat(self.index_path).st_mtime
+
+            with open(self.index_path, encoding="utf-8") as f:
+                self._index = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            log.warning("Music library index {0} is corrupt, starting empty".format(
+                self.index_path))
+
+    def _follow_index(self):
+        # Without analyse, metadata and loudness come from the index that
+        # another process (the first shard) measures and saves
+        if not self.index_path:
+            return
+
+        try:
+            mtime = os.stat(self.index_path).st_mtime
+        except OSError:
+            return
+
+        if mtime == self._index_mtime:
+            return
+
+        self.load_index()
+
+        for track in self.tracks():
+            known = self._index.get(track.name)
+
+            if known and known[:2] == [track.size, track.mtime]:
+                track.duration, track.codec, track.loudness, track.peak = known[2:6]
+
+    def _save_index(self):
+        if not self.index_path or not self.analyse:
+            return
+
+        with self._lock:
+            index = {t.name: [t.size, t.mtime, t.duration, t.codec, t.loudness, t.peak]
+                     for t in self._tracks.values()}
+
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        tmp_path = "{0}.{1}.tmp".format(self.index_path, os.getpid())
+
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            log.error("Unable to save music library index: {0}".format(e))
+
+    def _run(self):
+        # Read on this thread, so a large index does not delay startup
+        self.load_index()
+
+        while not self._stop.is_set():
+            try:
+                self.rescan()
+            except Exception:
+                log.exception("Failed to scan music directory {0}".format(
+                    self.directory))
+            finally:
+                self.ready.set()
+
+            if not self.analyse:
+                self._follow_index()
+            else:
+                try:
+                    if not self.probe_pending(self.rescan_interval):
+                        continue
+                except Exception:
+                    log.exception("Failed to probe songs")
+
+                if self.loudness_target is not None:
+                    try:
+                        if not self.analyse_pending(self.rescan_interval):
+                            continue
+                    except Exception:
+                        log.exception("Failed to analyse loudness")
+
+            self._stop.wait(self.rescan_interval)
+
+    def rescan(self):
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime
+        except FileNotFoundError:
+            log.warning("Music directory {0} does not exist".format(self.directory))
+            return
+
+        # Adding, removing or renaming an entry bumps the directory mtime,
+        # which is far cheaper to check on network storage than a listing
+        if dir_mtime == self._dir_mtime:
+            return
+
+        seen = set()
+        probe = []
+
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+
+                stat = entry.stat()
+                seen.add(entry.name)
+                track = self._tracks.get(entry.name)
+
+                if track and track.size == stat.st_size and track.mtime == stat.st_mtime:
+                    continue
+
+                track = Track(entry.name, entry.path, stat.st_size, stat.st_mtime,
+                    codec=os.path.splitext(entry.name)[1][1:].lower() or None)
+                known = self._index.get(entry.name)
+
+                # Metadata and loudness of unchanged songs survive a restart
+                if known and known[:2] == [track.size, track.mtime]:
+                    track.duration, track.codec, track.loudness, track.peak = known[2:6]
+
+                self._add(track)
+                probe.append(track)
+
+        for name in set(self._tracks).difference(seen):
+            self._remove(name)
+
+        self._dir_mtime = dir_mtime
+
+        log.debug("Indexed {0} songs ({1} new or changed)".format(
+            len(self._tracks), len(probe)))
+
+        # Probing is left to probe_pending, so the listing is usable and
+        # saved straight away
+        self._unprobed.extend(t for t in probe if t.duration is None)
+
+        if self.analyse:
+            self._index = {}
+            self._save_index()
+
+    def probe_pending(self, budget=None):
+        # Returns whether every new song has been probed, saving what was
+        # read so far like analyse_pending does
+        deadline = None if budget is None else time.monotonic() + budget
+        done = 0
+
+        while self._unprobed:
+            if self._stop.is_set() or not self.probe or \
+                    (deadline is not None and time.monotonic() > deadline):
+                break
+
+            track = self._unprobed.pop()
+
+            # Removed or changed again since it was listed
+            if self._tracks.get(track.name) is not track:
+                continue
+
+            self._probe(track)
+            done += 1
+
+        if done:
+            self._save_index()
+
+        if not self.probe:
+            self._unprobed.clear()
+
+        return not self._unprobed
+
+    def analyse_pending(self, budget=None):
+        # Returns whether every song has been analysed. A budget in seconds
+        # lets rescans run between batches of a large library
+        pending = [t for t in self.tracks() if t.loudness is None]
+        deadline = None if budget is None else time.monotonic() + budget
+        done = 0
+
+        for track in pending:
+            if self._stop.is_set() or self.loudness_target is None or \
+                    (deadline is not None and time.monotonic() > deadline):
+                break
+
+            self._analyse(track)
+            done += 1
+
+        if done:
+            self._save_index()
+
+        return done == len(pending)
+
+    def _add(self, track):
+        with self._lock:
+            if track.name not in self._positions:
+                self._positions[track.name] = len(self._names)
+                self._names.append(track.name)
+
+            self._tracks[track.name] = track
+
+        self.search_index.add(track.name, track.title)
+
+    def _remove(self, name):
+        self.search_index.remove(name)
+
+        with self._lock:
+            self._tracks.pop(name, None)
+            index = self._positions.pop(name, None)
+
+            if index is None:
+                return
+
+            # Swap the last name into the vacated slot to keep removal O(1)
+            last = self._names.pop()
+
+            if index < len(self._names):
+                self._names[index] = last
+                self._positions[last] = index
+
+    def _probe(self, track):
+        args = ["ffprobe", "-v", "quiet", "-print_format", "json",
+                "-show_format", "-show_streams", "-select_streams", "a:0",
+                track.path]
+
+        try:
+            output = subprocess.check_output(args, stdin=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL, timeout=30)
+        except FileNotFoundError:
+            log.warning("ffprobe was not found, song metadata will be limited")
+            self.probe = False
+            return
+        except (subprocess.SubprocessError, OSError):
+            log.debug("Unable to probe {0}".format(track.path))
+            return
+
+        try:
+            info = json.loads(output.decode("utf-8"))
+        except ValueError:
+            return
+
+        streams = info.get("streams") or [{}]
+        duration = info.get("format", {}).get("duration")
+
+        if duration is not None:
+            track.duration = float(duration)
+
+        track.codec = streams[0].get("codec_name", track.codec)
+
+    def _analyse(self, track):
+        # Integrated loudness (EBU R128) and true peak from ffmpeg's
+        # loudnorm filter in measuring mode
+        args = ["ffmpeg", "-nostdin", "-hide_banner", "-nostats", "-i", track.path,
+                "-map", "0:a:0", "-af", "loudnorm=print_format=json",
+                "-f", "null", "-"]
+
+        try:
+            output = subprocess.run(args, stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                timeout=600).stderr.decode("utf-8", "replace")
+        except FileNotFoundError:
+            log.warning("ffmpeg was not found, loudness will not be normalised")
+            self.loudness_target = None
+            return
+        except (subprocess.SubprocessError, OSError):
+            output = ""
+
+        try:
+            # ffmpeg may print more lines after the JSON
+            info, _ = json.JSONDecoder().raw_decode(output, output.rindex("{"))
+            track.loudness = float(info["input_i"])
+            track.peak = float(info["input_tp"])
+        except (ValueError, KeyError):
+            # Not a number, so the song is left alone instead of retried
+            log.debug("No loudness measured for {0}".format(track.path))
+            track.loudness = float("nan")
+            return
+
+        log.debug("{0}: {1:.1f} LUFS, peak {2:.1f} dBTP".format(
+            track.name, track.loudness, track.peak))
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+import logging.handlers
+
+from collections import Counter
+
+import colorlog
+
+# Loggers that write to the console below WARNING
+CONSOLE_LOGGER = __package__
+DISCORD_LOGGER = "discord"
+
+_pipeline = None
+
+def parse_sampling(value):
+    # "discord.gateway:50, discord.state:20" -> {"discord.gateway": 50.0, ...}
+    rates = {}
+
+    for item in value.split(","):
+        if item.strip():
+            name, _, rate = item.partition(":")
+            rates[name.strip()] = float(rate)
+
+    return rates
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+
+        return json.dumps(entry, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    # Token bucket per configured logger (and its children) for records
+    # below WARNING, so a chatty library cannot flood the queue. Warnings
+    # and errors always pass.
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.sampled = Counter()
+
+        self._prefixes = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _prefix(self, name):
+        try:
+            return self._prefixes[name]
+        except KeyError:
+            pass
+
+        prefix = None
+        parts = name.split(".")
+
+        # The most specific configured logger wins
+        for i in range(len(parts), 0, -1):
+            if ".".join(parts[:i]) in self.rates:
+                prefix = ".".join(parts[:i])
+                break
+
+        self._prefixes[name] = prefix
+        return prefix
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+
+        prefix = self._prefix(record.name)
+
+        if prefix is None:
+            return True
+
+        rate = self.rates[prefix]
+        burst = max(1.0, rate)
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, last = self._buckets.get(prefix, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+
+            if tokens < 1:
+                self._buckets[prefix] = (tokens, now)
+                self.sampled[prefix] += 1
+                return False
+
+            self._buckets[prefix] = (tokens - 1, now)
+
+        return True
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    # Runs on the thread that logs. Only the message is rendered here,
+    # formatting, tracebacks and I/O are left to the listener thread.
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        # Never block the event loop on a full queue
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LogListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # The queue may be full, wait for the listener to make room
+        self.queue.put(self._sentinel)
+
+class LogPipeline:
+    def __init__(self, handlers, *, queue_size=10000, sampling=None):
+        self.queue = queue.Queue(queue_size)
+        self.handler = LogQueueHandler(self.queue)
+        self.sampler = None
+
+        if sampling:
+            self.sampler = SamplingFilter(sampling)
+            self.handler.addFilter(self.sampler)
+
+        self.listener = LogListener(self.queue, *handlers,
+            respect_handler_level=True)
+        self.running = False
+
+    def attach(self, name, level):
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        logger.addHandler(self.handler)
+        logger.propagate = False
+
+    def start(self):
+        self.listener.start()
+        self.running = True
+
+    def stop(self):
+        # Writes out whatever is still queued
+        if self.running:
+            self.running = False
+            self.listener.stop()
+
+        for handler in self.listener.handlers:
+            handler.close()
+
+    def to_dict(self):
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.handler.dropped,
+            "sampled": dict(self.sampler.sampled) if self.sampler else {}
+        }
+
+def _console_filter(record):
+    return record.levelno >= logging.WARNING or record.name == CONSOLE_LOGGER or \
+        record.name.startswith(CONSOLE_LOGGER + ".")
+
+def _file_handler(path, config):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    if config.log_rotate_when:
+        handler = logging.handlers.TimedRotatingFileHandler(path,
+            when=config.log_rotate_when, backupCount=config.log_backups,
+            encoding="utf-8")
+    elif config.log_max_bytes:
+        handler = logging.handlers.RotatingFileHandler(path,
+            maxBytes=config.log_max_bytes, backupCount=config.log_backups,
+            encoding="utf-8")
+    else:
+        handler = logging.FileHandler(path, encoding="utf-8")
+
+    if config.log_json:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(
+            "{asctime}:{levelname}:{name}: {message}", style='{'))
+
+    return handler
+
+def setup_logging(config):
+    shandler = logging.StreamHandler(stream=sys.stdout)
+    shandler.setFormatter(colorlog.LevelFormatter(
+        fmt = {
+            "DEBUG": "{log_color}[{levelname}:{module}] {message}",
+            "INFO": "{log_color}{message}",
+            "WARNING": "{log_color}{levelname}: {message}",
+            "ERROR": "{log_color}[{levelname}:{module}] {message}",
+            "CRITICAL": "{log_color}[{levelname}:{module}] {message}"
+        },
+        log_colors = {
+            "DEBUG":    "cyan",
+            "INFO":     "white",
+            "WARNING":  "yellow",
+            "ERROR":    "red",
+            "CRITICAL": "bold_red"
+        },
+        style = '{',
+        datefmt = ''
+    ))
+    shandler.setLevel(config.debug_level)
+    shandler.addFilter(_console_filter)
+    handlers = [shandler]
+
+    if config.log_file:
+        fhandler = _file_handler(config.log_file, config)
+        fhandler.setLevel(config.debug_level)
+        fhandler.addFilter(_console_filter)
+        handlers.append(fhandler)
+
+    if config.debug_mode:
+        dhandler = _file_handler(config.debug_log_file, config)
+        dhandler.addFilter(logging.Filter(DISCORD_LOGGER))
+        handlers.append(dhandler)
+
+    pipeline = LogPipeline(handlers, queue_size=config.log_queue_size,
+        sampling=config.log_sampling)
+    pipeline.attach(CONSOLE_LOGGER, config.debug_level)
+    pipeline.attach(DISCORD_LOGGER, logging.DEBUG if config.debug_mode else logging.WARNING)
+
+    global _pipeline
+    _pipeline = pipeline
+    return pipeline
+
+def detach_queue():
+    # Called first thing in forked worker processes. Nothing drains the
+    # queue there, so they write with the same handlers directly.
+    pipeline = _pipeline
+
+    if pipeline is None:
+        return
+
+    for name in (CONSOLE_LOGGER, DISCORD_LOGGER):
+        logger = logging.getLogger(name)
+
+        if pipeline.handler in logger.handlers:
+            logger.removeHandler(pipeline.handler)
+
+            for handler in pipeline.listener.handlers:
+                # The lock may have been held by the listener when we forked
+                handler.createLock()
+                logger.addHandler(handler)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+class MemberIndex:
+    # Members by user id, then by server id. Kept in sync from the member
+    # and server events so lookups never scan every member of every server.
+
+    def __init__(self):
+        self._members = {}
+
+    def __len__(self):
+        return sum(len(m) for m in self._members.values())
+
+    def rebuild(self, servers):
+        self._members = {}
+
+        for server in servers:
+            self.add_server(server)
+
+    def add_server(self, server):
+        for member in server.members:
+            self.add(member)
+
+    def remove_server(self, server):
+        for by_server in self._members.values():
+            by_server.pop(server.id, None)
+
+        self._members = {k: v for k, v in self._members.items() if v}
+
+    def add(self, member):
+        self._members.setdefault(member.id, {})[member.server.id] = member
+
+    def remove(self, member):
+        by_server = self._members.get(member.id)
+
+        if by_server is None:
+            return
+
+        by_server.pop(member.server.id, None)
+
+        if not by_server:
+            del self._members[member.id]
+
+    def get(self, user_id, *, server=None, voice=False):
+        by_server = self._members.get(user_id)
+
+        if not by_server:
+            return None
+
+        if server is not None:
+            member = by_server.get(server.id)
+            return member if member and (member.voice_channel or not voice) else None
+
+        for member in by_server.values():
+            if member.voice_channel or not voice:
+                return member
+
+        return None
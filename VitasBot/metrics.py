@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import json
+import logging
+
+from aiohttp import web
+
+from .voicestats import Histogram as Buckets
+
+log = logging.getLogger(__name__)
+
+# Seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+CONNECT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 15.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+
+    if extra:
+        pairs.append(extra)
+
+    if not pairs:
+        return ""
+
+    return "{" + ",".join("{0}=\"{1}\"".format(k, _escape(v)) for k, v in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.fn = fn
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        # The callback returns a number, or a dict of label values to numbers
+        if self.fn is None:
+            return self._values.items()
+
+        values = self.fn()
+        return values.items() if isinstance(values, dict) else [((), values)]
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.help),
+                 "# TYPE {0} {1}".format(self.name, self.kind)]
+
+        for key, value in sorted(self.samples()):
+            lines.append("{0}{1} {2}".format(self.name,
+                _format_labels(self.labels, key), _format_value(value)))
+
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        histogram = self._values.get(key)
+
+        if histogram is None:
+            histogram = self._values[key] = Buckets(self.buckets)
+
+        histogram.observe(value)
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.help),
+                 "# TYPE {0} {1}".format(self.name, self.kind)]
+
+        for key, histogram in sorted(self._values.items()):
+            total = 0
+
+            for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+                total += count
+                lines.append("{0}_bucket{1} {2}".format(self.name,
+                    _format_labels(self.labels, key, ("le", _format_value(bound))),
+                    total))
+
+            labels = _format_labels(self.labels, key)
+            lines.append("{0}_sum{1} {2!r}".format(self.name, labels, histogram.sum))
+            lines.append("{0}_count{1} {2}".format(self.name, labels, histogram.count))
+
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=(), fn=None):
+        return self._register(Counter(name, help, labels, fn))
+
+    def gauge(self, name, help, labels=(), fn=None):
+        return self._register(Gauge(name, help, labels, fn))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+
+        for metric in self._metrics:
+            try:
+                lines += metric.render()
+            except Exception:
+                log.exception("Failed to collect {0}".format(metric.name))
+
+        return "\n".join(lines) + "\n"
+
+class BotMetrics(Registry):
+    def __init__(self, bot):
+        super().__init__()
+
+        def voice(attr):
+            return lambda: {(k,): getattr(v, attr) for k, v in bot.voice_stats.items()}
+
+        self.messages = self.counter("vitasbot_messages_total",
+            "Messages received")
+        self.ignored = self.counter("vitasbot_messages_ignored_total",
+            "Messages ignored, by reason", ("reason",),
+            fn=lambda: {(k,): v for k, v in bot.ignored_messages.items()})
+        self.command_duration = self.histogram("vitasbot_command_duration_seconds",
+            "Time to run a command", ("command",))
+        self.command_errors = self.counter("vitasbot_command_errors_total",
+            "Commands that raised, by exception type", ("command", "type"))
+
+        self.send_duration = self.histogram("vitasbot_send_message_duration_seconds",
+            "Time for Discord to accept a message")
+        self.send_errors = self.counter("vitasbot_send_message_errors_total",
+            "Messages that failed to send, by error type", ("type",))
+        self.sender_merged = self.counter("vitasbot_messages_merged_total",
+            "Queued messages merged into another", fn=lambda: bot.sender.merged)
+        self.sender_pending = self.gauge("vitasbot_messages_pending",
+            "Messages waiting in the send queues", fn=lambda: bot.sender.pending())
+
+        self.voice_connect = self.histogram("vitasbot_voice_connect_duration_seconds",
+            "Time to connect to a voice channel", ("result",), buckets=CONNECT_BUCKETS)
+        self.players = self.gauge("vitasbot_players",
+            "Active music players", fn=lambda: len(bot.players))
+        self.broadcast_listeners = self.gauge("vitasbot_broadcast_listeners",
+            "Servers listening to the broadcast",
+            fn=lambda: len(bot.broadcast) if bot.broadcast else 0)
+        self.voice_frames = self.counter("vitasbot_voice_frames_total",
+            "Voice frames sent", ("server",), fn=voice("frames"))
+        self.voice_late = self.counter("vitasbot_voice_frames_late_total",
+            "Voice frames sent late", ("server",), fn=voice("late"))
+        self.voice_dropped = self.counter("vitasbot_voice_frames_dropped_total",
+            "Voice frames skipped after a stall", ("server",), fn=voice("dropped"))
+
+        self.startup = self.gauge("vitasbot_startup_phase_seconds",
+            "Seconds spent in each phase of starting up", ("phase",),
+            fn=lambda: {(k,): v for k, v in bot.startup.to_dict()["phases"].items()})
+
+        self.loop_lag = self.gauge("vitasbot_loop_lag_seconds",
+            "Latest delay of a callback on the event loop")
+        self.loop_lag_histogram = self.histogram("vitasbot_loop_lag_histogram_seconds",
+            "Delay of callbacks on the event loop")
+        self.loop_stalls = self.counter("vitasbot_loop_stalls_total",
+            "Times the event loop was blocked past the stall threshold",
+            fn=lambda: bot.watchdog.stalls if bot.watchdog else 0)
+
+        self.log_queued = self.gauge("vitasbot_log_records_queued",
+            "Log records waiting to be written",
+            fn=lambda: bot.log_pipeline.queue.qsize() if bot.log_pipeline else 0)
+        self.log_dropped = self.counter("vitasbot_log_records_dropped_total",
+            "Log records dropped because the queue was full",
+            fn=lambda: bot.log_pipeline.handler.dropped if bot.log_pipeline else 0)
+        self.log_sampled = self.counter("vitasbot_log_records_sampled_total",
+            "Log records left out by sampling, by logger", ("logger",),
+            fn=lambda: {(k,): v for k, v in bot.log_pipeline.to_dict()["sampled"].items()}
+                       if bot.log_pipeline else {})
+
+    def observe_loop_lag(self, lag):
+        self.loop_lag.set(lag)
+        self.loop_lag_histogram.observe(lag)
+
+class MetricsServer:
+    # Serves /metrics in the Prometheus text format and /stats as JSON from
+    # the bot's own event loop.
+
+    def __init__(self, bot, *, host="127.0.0.1", port=9184):
+        self.bot = bot
+        self.host = host
+        self.port = port
+
+        self._app = None
+        self._handler = None
+        self._server = None
+
+    async def start(self):
+        self._app = web.Application(loop=self.bot.loop)
+        self._app.router.add_route("GET", "/metrics", self.handle_metrics)
+        self._app.router.add_route("GET", "/stats", self.handle_stats)
+        self._handler = self._app.make_handler()
+
+        self._server = await self.bot.loop.create_server(self._handler,
+            self.host, self.port)
+
+        log.info("Serving metrics on http://{0}:{1}/metrics".format(self.host, self.port))
+
+    async def stop(self):
+        if self._server is None:
+            return
+
+        self._server.close()
+        await self._server.wait_closed()
+        await self._handler.finish_connections(1.0)
+        await self._app.finish()
+        self._server = None
+
+    async def handle_metrics(self, request):
+        return web.Response(body=self.bot.metrics.render().encode("utf-8"),
+            headers={"Content-Type": CONTENT_TYPE})
+
+    async def handle_stats(self, request):
+        return web.Response(body=json.dumps(self.bot.stats_snapshot()).encode("utf-8"),
+            headers={"Content-Type": "application/json"})
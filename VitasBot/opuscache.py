@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import sys
+import json
+import queue
+import struct
+import hashlib
+import logging
+import threading
+import subprocess
+
+from discord import opus
+
+from .utils import update_json
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"VBOPUS1\n"
+FRAME_HEADER = struct.Struct("<H")
+
+CONFIG_FILE = "config/config.ini"
+
+SAMPLING_RATE = 48000
+CHANNELS = 2
+
+def file_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha1()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+class OpusFrameReader:
+    encoded = True
+
+    def __init__(self, path, *, start=0):
+        self.path = path
+        self._file = open(path, "rb")
+
+        if self._file.read(len(MAGIC)) != MAGIC:
+            self._file.close()
+            raise ValueError("{0} is not an opus frame cache file".format(path))
+
+        for i in range(start):
+            header = self._file.read(FRAME_HEADER.size)
+
+            if len(header) != FRAME_HEADER.size:
+                break
+
+            self._file.seek(FRAME_HEADER.unpack(header)[0], os.SEEK_CUR)
+
+    def read(self):
+        header = self._file.read(FRAME_HEADER.size)
+
+        if len(header) != FRAME_HEADER.size:
+            return b""
+
+        length, = FRAME_HEADER.unpack(header)
+        return self._file.read(length)
+
+    def close(self):
+        self._file.close()
+
+def encode_file(path, out_path, *, gain=0.0, ffmpeg="ffmpeg"):
+    encoder = opus.Encoder(SAMPLING_RATE, CHANNELS)
+    args = [ffmpeg, "-nostdin", "-loglevel", "quiet", "-i", path,
+            "-f", "s16le", "-ar", str(SAMPLING_RATE), "-ac", str(CHANNELS)]
+
+    if gain:
+        args += ["-af", "volume={0:.2f}dB".format(gain)]
+
+    args.append("pipe:1")
+
+    tmp_path = "{0}.{1}.tmp".format(out_path, os.getpid())
+    process = subprocess.Popen(args, stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    try:
+        with open(tmp_path, "wb") as out:
+            out.write(MAGIC)
+
+            while True:
+                pcm = process.stdout.read(encoder.frame_size)
+
+                if not pcm:
+                    break
+
+                if len(pcm) < encoder.frame_size:
+                    pcm += b"\x00" * (encoder.frame_size - len(pcm))
+
+                frame = encoder.encode(pcm, encoder.samples_per_frame)
+                out.write(FRAME_HEADER.pack(len(frame)))
+                out.write(frame)
+
+        process.stdout.close()
+
+        if process.wait() != 0:
+            raise RuntimeError("ffmpeg failed to decode {0}".format(path))
+    except BaseException:
+        # The original error is raised, cleaning up must not replace it
+        process.kill()
+        process.stdout.close()
+        process.wait()
+
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+        raise
+
+    os.replace(tmp_path, out_path)
+
+class OpusCache:
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+
+        self._index = {}
+        self._index_mtime = None
+        self._pending = set()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._reload()
+
+    def _reload(self):
+        # Shards share the cache, pick up what the others have added
+        try:
+            mtime = os.stat(self.index_path).st_mtime
+
+            if mtime == self._index_mtime:
+                return
+
+            with open(self.index_path, encoding="utf-8") as f:
+                self._index = json.load(f)
+
+            self._index_mtime = mtime
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            log.warning("Opus cache index {0} is corrupt, starting empty".format(
+                self.index_path))
+
+    def _frames_path(self, digest, gain):
+        if gain:
+            digest += "{0:+.1f}dB".format(gain)
+
+        return os.path.join(self.directory, digest + ".opus")
+
+    def get(self, track, gain=0.0):
+        # Frames are encoded with the song's normalisation gain baked in
+        gain = round(gain, 1)
+        entry = self._index.get(track.name)
+
+        if not self._matches(entry, track, gain):
+            self._reload()
+            entry = self._index.get(track.name)
+
+            if not self._matches(entry, track, gain):
+                return None
+
+        path = self._frames_path(entry[2], gain)
+        return path if os.path.isfile(path) else None
+
+    @staticmethod
+    def _matches(entry, track, gain):
+        return entry is not None and entry[:2] == [track.size, track.mtime] and \
+            (entry[3] if len(entry) > 3 else 0.0) == gain
+
+    def request(self, track, gain=0.0):
+        with self._lock:
+            if track.name in self._pending:
+                return
+
+            self._pending.add(track.name)
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                name="OpusCache", daemon=True)
+            self._thread.start()
+
+        self._queue.put((track, gain))
+
+    def stop(self):
+        self._queue.put(None)
+
+    def fill(self, track, gain=0.0):
+        if self.get(track, gain):
+            return
+
+        gain = round(gain, 1)
+        digest = file_hash(track.path)
+        path = self._frames_path(digest, gain)
+
+        if not os.path.isfile(path):
+            log.debug("Encoding {0} into the opus cache".format(track.name))
+            encode_file(track.path, path, gain=gain)
+
+        entry = [track.size, track.mtime, digest, gain]
+
+        def update(index):
+            index[track.name] = entry
+            return index
+
+        with self._lock:
+            self._index = update_json(self.index_path, update)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+
+            if item is None:
+                break
+
+            track, gain = item
+
+            try:
+                self.fill(track, gain)
+            except Exception:
+                log.exception("Failed to cache {0}".format(track.name))
+            finally:
+                with self._lock:
+                    self._pending.discard(track.name)
+
+def main(argv=None):
+    from .config import Config, ConfigDefaults
+    from .library import MusicLibrary
+    from .utils import load_opus_lib
+
+    argv = sys.argv[1:] if argv is None else argv
+
+    if len(argv) not in (2, 3):
+        print("Usage: python -m VitasBot.opuscache <music_dir> <cache_dir> "
+              "[config_file]")
+        return 2
+
+    logging.basicConfig(level=logging.INFO)
+    load_opus_lib()
+
+    # Frames are only used when they were made at the gain the bot plays
+    # the song at, so loudness comes from the bot's settings and index
+    config_file = argv[2] if len(argv) > 2 else CONFIG_FILE
+    config = Config(config_file) if os.path.exists(config_file) else ConfigDefaults()
+
+    library = MusicLibrary(argv[0], probe=False,
+        loudness_target=config.loudness_target if config.normalize else None,
+        index_path=config.library_index)
+
+    library.load_index()
+    library.rescan()
+    library.analyse_pending()
+    cache = OpusCache(argv[1])
+
+    for i, track in enumerate(sorted(library.tracks(), key=lambda t: t.name), 1):
+        try:
+            cache.fill(track, library.gain(track))
+        except Exception as e:
+            log.error("Failed to cache {0}: {1}".format(track.name, e))
+        else:
+            log.info("[{0}/{1}] {2}".format(i, len(library), track.name))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import json
+import random
+import logging
+import threading
+
+from collections import OrderedDict
+
+from .opuscache import file_hash
+
+log = logging.getLogger(__name__)
+
+EXTENSIONS = (".jpg", ".jpeg", ".gif", ".gifv", ".png", ".webm")
+
+class Picture:
+    __slots__ = ("name", "path", "size", "mtime", "digest")
+
+    def __init__(self, name, path, size, mtime):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.digest = None
+
+    def __repr__(self):
+        return "<Picture name={0.name!r} size={0.size}>".format(self)
+
+class PictureLibrary:
+    def __init__(self, directory, *, extensions=EXTENSIONS, rescan_interval=30):
+        self.directory = directory
+        self.extensions = tuple(e.lower() for e in extensions)
+        self.rescan_interval = rescan_interval
+
+        self._pictures = {}
+        self._names = []
+        self._dir_mtime = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._names)
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._thread = threading.Thread(target=self._run,
+            name="PictureLibrary", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # Scanned here rather than on each picture command, which runs on
+        # the bot's loop
+        while not self._stop.is_set():
+            try:
+                self.rescan()
+            except Exception:
+                log.exception("Failed to scan pictures directory {0}".format(
+                    self.directory))
+
+            self._stop.wait(self.rescan_interval)
+
+    def rescan(self):
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime
+        except FileNotFoundError:
+            log.warning("Pictures directory {0} does not exist".format(self.directory))
+            return
+
+        if dir_mtime == self._dir_mtime:
+            return
+
+        pictures = {}
+
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.lower().endswith(self.extensions) or \
+                        not entry.is_file():
+                    continue
+
+                stat = entry.stat()
+                picture = self._pictures.get(entry.name)
+
+                # Keep the hash of files that have not changed
+                if picture is None or picture.size != stat.st_size or \
+                        picture.mtime != stat.st_mtime:
+                    picture = Picture(entry.name, entry.path, stat.st_size, stat.st_mtime)
+
+                pictures[entry.name] = picture
+
+        with self._lock:
+            self._pictures = pictures
+            self._names = list(pictures)
+
+        self._dir_mtime = dir_mtime
+
+        log.debug("Indexed {0} pictures in {1}".format(len(pictures), self.directory))
+
+    def pictures(self):
+        return list(self._pictures.values())
+
+    def random_picture(self):
+        with self._lock:
+            if not self._names:
+                return None
+
+            return self._pictures[random.choice(self._names)]
+
+    @staticmethod
+    def digest(picture):
+        if picture.digest is None:
+            picture.digest = file_hash(picture.path)
+
+        return picture.digest
+
+class UploadCache:
+    # Attachment URLs of pictures that were already uploaded, keyed by the
+    # content hash, so the same file is only ever uploaded once.
+
+    def __init__(self, path=None, *, size=256, ttl=7 * 24 * 60 * 60):
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._urls = OrderedDict()
+        self._save_lock = threading.Lock()
+
+        if path:
+            self._load()
+
+    def __len__(self):
+        return len(self._urls)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            log.warning("Picture cache {0} is corrupt, starting empty".format(self.path))
+            return
+
+        for digest, url, stored in entries[-self.size:]:
+            self._urls[digest] = (url, stored)
+
+    def entries(self):
+        return [[digest, url, stored] for digest, (url, stored) in self._urls.items()]
+
+    def save(self, entries=None):
+        # Entries taken beforehand let the writing happen on another thread
+        if not self.path:
+            return
+
+        if entries is None:
+            entries = self.entries()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+
+        with self._save_lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+
+            os.replace(tmp_path, self.path)
+
+    def get(self, digest):
+        entry = self._urls.get(digest)
+
+        if entry is None or time.time() - entry[1] > self.ttl:
+            self._urls.pop(digest, None)
+            self.misses += 1
+            return None
+
+        self._urls.move_to_end(digest)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, digest, url):
+        self._urls[digest] = (url, time.time())
+        self._urls.move_to_end(digest)
+
+        while len(self._urls) > self.size:
+            self._urls.popitem(last=False)
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import math
+import shlex
+import random
+import audioop
+import logging
+import threading
+import subprocess
+
+from collections import deque
+
+from discord import ClientException
+
+from .opuscache import SAMPLING_RATE, CHANNELS
+from .voicestats import FrameStats
+
+log = logging.getLogger(__name__)
+
+FRAME_LENGTH = 20
+FRAME_SIZE = SAMPLING_RATE // 1000 * FRAME_LENGTH * CHANNELS * 2
+
+class FFmpegSource:
+    encoded = False
+
+    def __init__(self, path, *, before_options=None, options=None, volume=1.0):
+        args = ["ffmpeg", "-nostdin"]
+        args += shlex.split(before_options or "")
+        args += ["-i", path, "-f", "s16le", "-ar", str(SAMPLING_RATE),
+                 "-ac", str(CHANNELS), "-loglevel", "warning"]
+
+        # Scaling inside ffmpeg's filter graph costs nothing per frame here
+        if volume != 1.0:
+            args += ["-af", "volume={0:.6f}".format(volume)]
+        args += shlex.split(options or "")
+        args.append("pipe:1")
+
+        try:
+            self._process = subprocess.Popen(args, stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE)
+        except FileNotFoundError as e:
+            raise ClientException("ffmpeg was not found in your PATH environment variable") from e
+
+    def read(self):
+        data = self._process.stdout.read(FRAME_SIZE)
+        return data if len(data) == FRAME_SIZE else b""
+
+    def close(self):
+        self._process.kill()
+
+        if self._process.poll() is None:
+            self._process.communicate()
+
+class BufferedSource:
+    def __init__(self, source, frames):
+        self.source = source
+        self.frames = frames
+        self.encoded = source.encoded
+
+    def read(self):
+        if self.frames:
+            return self.frames.popleft()
+
+        return self.source.read()
+
+    def close(self):
+        self.source.close()
+
+class Prefetcher(threading.Thread):
+    # Opens the next track and buffers its first frames while the current
+    # track is still playing, so switching tracks costs no cold start.
+
+    def __init__(self, track, opener, volume, frames):
+        super().__init__(name="Prefetch", daemon=True)
+        self.track = track
+        self.opener = opener
+        self.volume = volume
+        self.count = frames
+        self.frames = deque()
+        self.source = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.source = self.opener(self.track, self.volume)
+
+            for i in range(self.count):
+                data = self.source.read()
+
+                if not data:
+                    break
+
+                self.frames.append(data)
+        except Exception as e:
+            self.error = e
+
+    def result(self):
+        self.join()
+
+        if self.error is not None:
+            raise self.error
+
+        return BufferedSource(self.source, self.frames)
+
+    def discard(self):
+        self.join()
+
+        if self.source is not None:
+            self.source.close()
+
+class GuildPlayer(threading.Thread):
+    def __init__(self, voice, opener, *, volume=1.0, prefetch_frames=50,
+                 on_track=None, after=None, stats=None, start_at=0.0):
+        super().__init__(name="Player-{0}".format(voice.server.id), daemon=True)
+        self.voice = voice
+        self.opener = opener
+        self.prefetch_frames = prefetch_frames
+        self.on_track = on_track
+        self.after = after
+        self.delay = FRAME_LENGTH / 1000.0
+        self.current = None
+        self.queue = deque()
+        self.gaps = deque(maxlen=100)
+        self.error = None
+        self.disconnected = False
+        self.stats = stats if stats is not None else FrameStats()
+
+        self._volume = 1.0
+        self.volume = volume
+        self._start_at = start_at
+        self._frames = 0
+        self._source = None
+        self._source_volume = 1.0
+        self._prefetcher = None
+        self._skip = threading.Event()
+        self._end = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._lock = threading.Lock()
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        value = float(value)
+
+        if not math.isfinite(value):
+            raise ValueError("Volume must be a finite number")
+
+        self._volume = min(max(value, 0.0), 2.0)
+
+    @property
+    def position(self):
+        # Seconds into the current song
+        return self._frames * self.delay
+
+    @property
+    def last_gap(self):
+        return self.gaps[-1] if self.gaps else None
+
+    def enqueue(self, track):
+        with self._lock:
+            self.queue.append(track)
+            return len(self.queue)
+
+    def shuffle(self):
+        with self._lock:
+            tracks = list(self.queue)
+            random.shuffle(tracks)
+            self.queue = deque(tracks)
+
+    def clear(self):
+        with self._lock:
+            self.queue.clear()
+
+    def upcoming(self):
+        with self._lock:
+            return list(self.queue)
+
+    def skip(self):
+        self._skip.set()
+        self._resumed.set()
+
+    def stop(self):
+        self._end.set()
+        self._resumed.set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def is_playing(self):
+        return self._resumed.is_set() and not self.is_done()
+
+    def is_paused(self):
+        return not self._resumed.is_set()
+
+    def is_done(self):
+        return self._end.is_set() or not self.voice.is_connected()
+
+    def run(self):
+        try:
+            self._do_run()
+        except Exception as e:
+            log.exception("Player for {0} failed".format(self.voice.server.name))
+            self.error = e
+        finally:
+            self._end.set()
+            self._close_source()
+
+            if self._prefetcher is not None:
+                self._prefetcher.discard()
+
+            if self.after is not None:
+                try:
+                    self.after()
+                except Exception:
+                    log.exception("Calling the after function failed")
+
+    def _close_source(self):
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+
+    def _next_track(self):
+        # A song that cannot be opened is logged and skipped, so it does not
+        # end the player and the rest of the queue with it
+        while True:
+            with self._lock:
+                if not self.queue:
+                    return None
+
+                track = self.queue.popleft()
+
+            self.stats.track_opened(time.time())
+            prefetcher, self._prefetcher = self._prefetcher, None
+            offset, self._start_at = self._start_at, 0.0
+            self._frames = int(offset / self.delay)
+
+            try:
+                self._open(track, prefetcher, offset)
+            except Exception:
+                log.exception("Unable to play {0} on {1}, skipping it".format(
+                    track, self.voice.server.name))
+                continue
+
+            self.current = track
+            return track
+
+    def _open(self, track, prefetcher, offset):
+        if offset:
+            # Resuming part way through a song, which is never prefetched
+            self._source_volume = self._volume
+            self._source = self.opener(track, self._source_volume, offset)
+        elif prefetcher is not None and prefetcher.track is track:
+            try:
+                self._source = prefetcher.result()
+            except Exception:
+                prefetcher.discard()
+                raise
+
+            self._source_volume = prefetcher.volume
+        else:
+            if prefetcher is not None:
+                threading.Thread(target=prefetcher.discard, daemon=True).start()
+
+            self._source_volume = self._volume
+            self._source = self.opener(track, self._source_volume)
+
+    def _update_prefetch(self):
+        with self._lock:
+            upcoming = self.queue[0] if self.queue else None
+
+        prefetcher = self._prefetcher
+
+        if prefetcher is not None:
+            if prefetcher.track is upcoming:
+                return
+
+            self._prefetcher = None
+            threading.Thread(target=prefetcher.discard, daemon=True).start()
+
+        if upcoming is not None:
+            self._prefetcher = Prefetcher(upcoming, self.opener, self._volume,
+                self.prefetch_frames)
+            self._prefetcher.start()
+
+    def _do_run(self):
+        loops = 0
+        start = time.time()
+        track_ended = None
+
+        while not self._end.is_set():
+            # Opened before waiting on a pause, so a player started paused
+            # still has a current track and position
+            if self._source is None:
+                if self._next_track() is None:
+                    break
+
+                if self.on_track is not None:
+                    self.on_track(self.current)
+
+            if not self._resumed.is_set():
+                self._resumed.wait()
+                self.stats.paused()
+                loops = 0
+                start = time.time()
+
+            if not self.voice.is_connected():
+                self.disconnected = True
+                break
+
+            if self._skip.is_set():
+                self._skip.clear()
+                self._close_source()
+                continue
+
+            self._update_prefetch()
+
+            read_start = time.perf_counter()
+
+            try:
+                data = self._source.read()
+            except Exception:
+                log.exception("Failed to read {0} on {1}, skipping it".format(
+                    self.current, self.voice.server.name))
+                data = b""
+
+            self.stats.decoded(time.perf_counter() - read_start)
+
+            if not data:
+                self._close_source()
+                track_ended = time.time()
+                continue
+
+            # The opener applies the volume; only a change since then is
+            # scaled here
+            if not self._source.encoded and self._source_volume and \
+                    self._volume != self._source_volume:
+                data = audioop.mul(data, 2, self._volume / self._source_volume)
+
+            self.voice.play_audio(data, encode=not self._source.encoded)
+            self.stats.frame_sent(time.time(), start + self.delay * loops)
+            self._frames += 1
+
+            if track_ended is not None:
+                self.gaps.append(time.time() - track_ended)
+                log.debug("Track change on {0} took {1:.1f}ms".format(
+                    self.voice.server.name, self.gaps[-1] * 1000))
+                track_ended = None
+
+            loops += 1
+            next_time = start + self.delay * loops
+            now = time.time()
+
+            # Don't burst frames to catch up after a stall, start over instead
+            if now - next_time > self.delay * 5:
+                self.stats.skipped(int((now - next_time) / self.delay))
+                loops = 0
+                start = now
+            elif next_time > now:
+                time.sleep(next_time - now)
+                self.stats.slept(time.time() - next_time)
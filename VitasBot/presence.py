@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import logging
+
+import asyncio
+import discord
+
+log = logging.getLogger(__name__)
+
+class PresenceUpdater:
+    # Collects playback state changes and turns a burst of them into a
+    # single gateway presence update, at most one per rate window.
+
+    def __init__(self, bot, *, debounce=1.0, interval=12.0):
+        self.bot = bot
+        self.debounce = debounce
+        self.interval = interval
+        self.last_status = None
+        self.updates_sent = 0
+
+        self._songs = {}
+        self._playing = set()
+        self._remote = {}
+        self._dirty = asyncio.Event(loop=bot.loop)
+        self._last_sent = 0.0
+
+    @property
+    def active_players(self):
+        return len(self._playing)
+
+    @property
+    def songs(self):
+        return dict(self._songs)
+
+    def set_remote(self, songs):
+        # What the other shards are playing, keyed by shard and server
+        if songs != self._remote:
+            self._remote = songs
+            self._dirty.set()
+
+    def set_playing(self, key, song, is_paused=False):
+        self._songs[key] = (song, is_paused)
+
+        if is_paused:
+            self._playing.discard(key)
+        else:
+            self._playing.add(key)
+
+        self._dirty.set()
+
+    def clear(self, key):
+        if self._songs.pop(key, None) is None:
+            return
+
+        self._playing.discard(key)
+        self._dirty.set()
+
+    def current_game(self):
+        song = None
+        is_paused = False
+
+        songs = dict(self._songs)
+        songs.update(self._remote)
+        playing = [k for k, (_, paused) in songs.items() if not paused]
+
+        if len(playing) > 1:
+            return discord.Game(name="music on {0} servers".format(len(playing)))
+        elif len(playing) == 1:
+            song, is_paused = songs[playing[0]]
+        elif len(songs) == 1:
+            song, is_paused = next(iter(songs.values()))
+
+        if not song:
+            return None
+
+        prefix = u"\u275A\u275A " if is_paused else u"\u25B6 "
+        return discord.Game(name="{0}{1}".format(prefix, song)[:128])
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+
+        while True:
+            await self._dirty.wait()
+
+            # Let a burst of changes settle before looking at the state
+            await asyncio.sleep(self.debounce, loop=self.bot.loop)
+
+            wait = self._last_sent + self.interval - time.monotonic()
+
+            if wait > 0:
+                await asyncio.sleep(wait, loop=self.bot.loop)
+
+            self._dirty.clear()
+            game = self.current_game()
+
+            if game == self.last_status:
+                continue
+
+            try:
+                await self.bot.change_presence(game=game)
+            except Exception:
+                log.exception("Failed to update presence")
+                self._dirty.set()
+            else:
+                self.last_status = game
+                self.updates_sent += 1
+            finally:
+                self._last_sent = time.monotonic()
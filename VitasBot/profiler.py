@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+
+from collections import Counter, deque
+
+log = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.005
+# Samples kept per stall, about five seconds of it
+MAX_STALL_SAMPLES = 1000
+
+def collapse(frame, root=None):
+    # One line of the collapsed stack format read by flamegraph.pl,
+    # outermost call first
+    names = []
+
+    while frame is not None:
+        code = frame.f_code
+        names.append("{0} ({1}:{2})".format(code.co_name,
+            os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+
+    if root is not None:
+        names.append(root)
+
+    return ";".join(reversed(names))
+
+def sample_stacks(seconds, interval=SAMPLE_INTERVAL):
+    # Samples every thread but the sampling one
+    own = threading.get_ident()
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != own:
+                stacks[collapse(frame, names.get(thread_id, str(thread_id)))] += 1
+
+        time.sleep(interval)
+
+    return stacks
+
+def format_collapsed(stacks):
+    return "".join("{0} {1}\n".format(stack, count)
+                   for stack, count in stacks.most_common())
+
+class LoopWatchdog(threading.Thread):
+    # Pings the event loop from a thread. A ping that is not answered
+    # within the threshold means something is blocking the loop, and the
+    # loop thread's stack is sampled until it answers.
+
+    def __init__(self, loop, *, interval=0.1, threshold=0.25, on_lag=None):
+        super().__init__(name="LoopWatchdog", daemon=True)
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.on_lag = on_lag
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.reports = deque(maxlen=20)
+
+        self._loop_thread = None
+        self._answered = threading.Event()
+        self._end = threading.Event()
+
+    def stop(self):
+        self._end.set()
+        self._answered.set()
+
+    def _beat(self, sent):
+        self._loop_thread = threading.get_ident()
+        self.lag = time.monotonic() - sent
+        self.max_lag = max(self.max_lag, self.lag)
+        self._answered.set()
+
+        if self.on_lag is not None:
+            self.on_lag(self.lag)
+
+    def run(self):
+        while not self._end.is_set():
+            self._answered.clear()
+            sent = time.monotonic()
+
+            try:
+                self.loop.call_soon_threadsafe(self._beat, sent)
+            except RuntimeError:
+                # The loop has been closed
+                break
+
+            if not self._answered.wait(self.threshold):
+                self._sample_stall(sent)
+
+            self._end.wait(self.interval)
+
+    def _sample_stall(self, sent):
+        stacks = Counter()
+        thread_id = self._loop_thread
+        samples = 0
+
+        while not self._answered.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(thread_id)
+
+            if frame is not None and samples < MAX_STALL_SAMPLES:
+                stacks[collapse(frame)] += 1
+                samples += 1
+
+        if self._end.is_set():
+            return
+
+        duration = time.monotonic() - sent
+        self.stalls += 1
+        self.reports.append((time.time(), duration, stacks))
+
+        top = "\n".join("  {0} x{1}".format(stack.replace(";", "\n    > "), count)
+                        for stack, count in stacks.most_common(1))
+        log.warning("Event loop was blocked for {0:.0f}ms{1}".format(
+            duration * 1000, " in\n" + top if top else ""))
+
+    def to_dict(self):
+        return {
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "stalls": self.stalls
+        }
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import json
+import heapq
+import logging
+import itertools
+
+import asyncio
+
+from collections import defaultdict
+
+log = logging.getLogger(__name__)
+
+# Discord accepts between 2 and 100 messages per bulk delete, none of them
+# older than two weeks
+BULK_DELETE_MAX = 100
+BULK_DELETE_MAX_AGE = 14 * 24 * 60 * 60
+
+DISCORD_EPOCH = 1420070400
+
+def snowflake_time(snowflake):
+    return (int(snowflake) >> 22) / 1000.0 + DISCORD_EPOCH
+
+def bulk_deletable(message_id):
+    # Leave an hour of slack for clock drift
+    return time.time() - snowflake_time(message_id) < BULK_DELETE_MAX_AGE - 3600
+
+class Scheduler:
+    # One task and one heap for every delayed action, instead of a sleeping
+    # task per action. Message deletions are persisted so they survive a
+    # restart, and the ones that fall due together are bulk deleted.
+
+    def __init__(self, bot, *, path=None, batch_window=1.0, save_interval=5.0):
+        self.bot = bot
+        self.path = path
+        self.batch_window = batch_window
+        self.save_interval = save_interval
+
+        self._heap = []
+        self._counter = itertools.count()
+        self._wake = asyncio.Event(loop=bot.loop)
+        self._dirty = False
+        self._saved = 0.0
+
+        if path:
+            self._load()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def call_later(self, delay, callback, *args):
+        self._push(time.time() + delay, (callback, args))
+
+    def delete_later(self, msg, delay):
+        self._push(time.time() + delay, (msg.channel.id, msg.id))
+        self._dirty = True
+
+    def _push(self, due, action):
+        entry = (due, next(self._counter), action)
+        heapq.heappush(self._heap, entry)
+
+        if self._heap[0] is entry:
+            self._wake.set()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                pending = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            log.warning("Expiry file {0} is corrupt, ignoring it".format(self.path))
+            return
+
+        for due, channel_id, message_id in pending:
+            heapq.heappush(self._heap, (due, next(self._counter), (channel_id, message_id)))
+
+        log.debug("Restored {0} pending message expiries".format(len(pending)))
+
+    def save(self):
+        if not self.path:
+            return
+
+        pending = [[due, action[0], action[1]] for due, i, action in self._heap
+                   if not callable(action[0])]
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(pending, f)
+
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._saved = time.time()
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+
+        while True:
+            if self._dirty and time.time() - self._saved >= self.save_interval:
+                try:
+                    self.save()
+                except OSError as e:
+                    log.error("Unable to save pending expiries: {0}".format(e))
+
+            timeout = self.save_interval if self._dirty else None
+
+            if self._heap:
+                wait = self._heap[0][0] - time.time()
+                timeout = wait if timeout is None else min(timeout, wait)
+
+            self._wake.clear()
+
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout, loop=self.bot.loop)
+                except asyncio.TimeoutError:
+                    pass
+
+            await self._run_due()
+
+    async def _run_due(self):
+        deadline = time.time()
+        deletions = defaultdict(list)
+
+        while self._heap and self._heap[0][0] <= deadline:
+            due, i, action = heapq.heappop(self._heap)
+
+            if callable(action[0]):
+                self._call(*action)
+            else:
+                deletions[action[0]].append(action[1])
+
+        # Deletions due shortly after can go out in the same bulk request
+        while deletions and self._heap and self._heap[0][0] <= deadline + self.batch_window:
+            if callable(self._heap[0][2][0]):
+                break
+
+            due, i, (channel_id, message_id) = heapq.heappop(self._heap)
+            deletions[channel_id].append(message_id)
+
+        if not deletions:
+            return
+
+        self._dirty = True
+
+        for channel_id, message_ids in deletions.items():
+            for i in range(0, len(message_ids), BULK_DELETE_MAX):
+                try:
+                    await self.bot.delete_message_ids(channel_id,
+                        message_ids[i:i + BULK_DELETE_MAX])
+                except Exception:
+                    log.exception("Failed to delete expired messages")
+
+    def _call(self, callback, args):
+        try:
+            result = callback(*args)
+
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result, loop=self.bot.loop)
+        except Exception:
+            log.exception("Scheduled call to {0} failed".format(callback))
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import re
+import math
+import heapq
+import threading
+
+from collections import defaultdict
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+def trigrams(token):
+    padded = "  {0} ".format(token)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SearchIndex:
+    # Minimum trigram similarity for a query token to match a library token
+    MIN_SIMILARITY = 0.3
+    SIMILARITY_MARGIN = 0.75
+    TRANSPOSITION_SIMILARITY = 0.8
+    EXPANSION_CACHE_SIZE = 4096
+
+    def __init__(self):
+        self._documents = {}
+        self._postings = defaultdict(set)
+        # The same postings split by the number of words in the title
+        self._by_length = defaultdict(lambda: defaultdict(set))
+        self._trigrams = defaultdict(set)
+        self._anagrams = defaultdict(set)
+        self._expansions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, key, text):
+        tokens = tokenize(text)
+
+        with self._lock:
+            self._remove(key)
+            self._documents[key] = (len(tokens), frozenset(tokens))
+
+            for token in self._documents[key][1]:
+                self._by_length[token][len(tokens)].add(key)
+
+                if token not in self._postings:
+                    for trigram in trigrams(token):
+                        self._trigrams[trigram].add(token)
+
+                    self._anagrams["".join(sorted(token))].add(token)
+
+                    self._expansions.clear()
+
+                self._postings[token].add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        document = self._documents.pop(key, None)
+
+        if document is None:
+            return
+
+        for token in document[1]:
+            keys = self._postings[token]
+            keys.discard(key)
+
+            by_length = self._by_length[token]
+            by_length[document[0]].discard(key)
+
+            if not by_length[document[0]]:
+                del by_length[document[0]]
+
+            if not keys:
+                del self._postings[token]
+                del self._by_length[token]
+
+                for trigram in trigrams(token):
+                    self._trigrams[trigram].discard(token)
+
+                    if not self._trigrams[trigram]:
+                        del self._trigrams[trigram]
+
+                anagram = "".join(sorted(token))
+                self._anagrams[anagram].discard(token)
+
+                if not self._anagrams[anagram]:
+                    del self._anagrams[anagram]
+
+                self._expansions.clear()
+
+    def _expand(self, token):
+        expansions = self._expansions.get(token)
+
+        if expansions is not None:
+            return expansions
+
+        if token in self._postings:
+            expansions = [(token, 1.0)]
+        else:
+            query_trigrams = trigrams(token)
+            hits = defaultdict(int)
+
+            for trigram in query_trigrams:
+                for candidate in self._trigrams.get(trigram, ()):
+                    hits[candidate] += 1
+
+            similarities = {}
+
+            for candidate, count in hits.items():
+                union = len(query_trigrams) + len(trigrams(candidate)) - count
+                similarities[candidate] = count / union
+
+            # Swapped letters share few trigrams but are a very common typo
+            for candidate in self._anagrams.get("".join(sorted(token)), ()):
+                similarities[candidate] = max(similarities.get(candidate, 0.0),
+                    self.TRANSPOSITION_SIMILARITY)
+
+            # Only keep the closest spellings, so a rare word that happens to
+            # look a bit alike cannot outweigh the obvious correction
+            cutoff = max(similarities.values(), default=0.0) * self.SIMILARITY_MARGIN
+            expansions = [(candidate, similarity)
+                          for candidate, similarity in similarities.items()
+                          if similarity >= max(cutoff, self.MIN_SIMILARITY)]
+
+        if len(self._expansions) >= self.EXPANSION_CACHE_SIZE:
+            self._expansions.clear()
+
+        self._expansions[token] = expansions
+        return expansions
+
+    def search(self, query, limit=1):
+        with self._lock:
+            return self._search(query, limit)
+
+    def _search(self, query, limit):
+        total = len(self._documents)
+        terms = []
+
+        for token in set(tokenize(query)):
+            weights = []
+            expansions = self._expand(token)
+
+            for candidate, similarity in expansions:
+                keys = self._postings[candidate]
+                idf = math.log(1 + total / len(keys))
+                weights.append((keys, similarity * similarity * idf))
+
+            if weights:
+                terms.append((sum(len(keys) for keys, weight in weights), weights,
+                    [candidate for candidate, similarity in expansions]))
+
+        if not terms:
+            return []
+
+        terms.sort(key=lambda t: (t[0], t[2]))
+
+        if all(len(weights) == 1 for size, weights, tokens in terms):
+            matched, candidates = self._narrow_by_length(terms, limit)
+
+            # Titles with every word all score the same, and come out already
+            # ranked by the fewest extra words
+            if matched == len(terms):
+                return candidates
+        else:
+            # Narrow down with set intersections, rarest word first, dropping
+            # the most common words from the end once no title matches them
+            # all. Each step only shrinks the set, so this stays cheap even
+            # for words shared by the whole library ("vitas")
+            candidates = self._union(terms[0][1])
+            matched = 1
+
+            for size, weights, tokens in terms[1:]:
+                narrowed = self._union(weights, candidates)
+
+                if not narrowed:
+                    break
+
+                candidates = narrowed
+                matched += 1
+
+        # Every candidate has a word among the first matched ones, which adds
+        # the same weight to each score unless it has several spellings
+        scores = dict.fromkeys(candidates, 0.0)
+        scored = [t for i, t in enumerate(terms) if i >= matched or len(t[1]) > 1]
+
+        for size, weights, tokens in scored:
+            best = {}
+
+            for keys, weight in weights:
+                for key in candidates.intersection(keys):
+                    if weight > best.get(key, 0.0):
+                        best[key] = weight
+
+            for key, weight in best.items():
+                scores[key] += weight
+
+        # Highest score first, then titles with fewer unmatched words
+        ranked = []
+
+        for score in sorted(set(scores.values()), reverse=True):
+            tied = [key for key, value in scores.items() if value == score]
+            ranked.extend(heapq.nsmallest(limit - len(ranked), tied,
+                key=lambda key: (self._documents[key][0], key)))
+
+            if len(ranked) >= limit:
+                break
+
+        return ranked
+
+    def _union(self, weights, within=None):
+        if within is None:
+            if len(weights) == 1:
+                return weights[0][0]
+
+            return set().union(*(keys for keys, weight in weights))
+
+        if len(weights) == 1:
+            return within & weights[0][0]
+
+        return set().union(*(within & keys for keys, weight in weights))
+
+    def _narrow_by_length(self, terms, limit):
+        # The same narrowing for words with a single spelling, done on the
+        # rarest word's titles one length at a time from the fewest words up.
+        # A title with every word then turns up after a handful of short
+        # titles; without one, the titles matching the most words are
+        # gathered across all lengths
+        by_length = self._by_length[terms[0][2][0]]
+        partial = [set() for term in terms[1:]]
+        results = []
+
+        for length in sorted(by_length):
+            found = by_length[length]
+
+            for i, (size, weights, tokens) in enumerate(terms[1:]):
+                found = found & weights[0][0]
+
+                if not found:
+                    break
+
+                partial[i] |= found
+            else:
+                results.extend(heapq.nsmallest(limit - len(results), found))
+
+                if len(results) >= limit:
+                    break
+
+        if results:
+            return len(terms), results
+
+        for i in reversed(range(len(partial))):
+            if partial[i]:
+                return i + 2, partial[i]
+
+        return 1, terms[0][1][0][0]
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import logging
+
+import asyncio
+
+from collections import deque
+
+from .constants import DISCORD_MSG_CHAR_LIMIT
+
+log = logging.getLogger(__name__)
+
+CODE_FENCE = "```"
+
+def _fence_header(line):
+    line = line.strip()
+    language = line[len(CODE_FENCE):]
+
+    if line.startswith(CODE_FENCE) and language.isalnum():
+        return line
+
+    return CODE_FENCE
+
+def _split_long_lines(lines, limit):
+    for line in lines:
+        while len(line) > limit:
+            yield line[:limit]
+            line = line[limit:]
+
+        yield line
+
+def chunk_message(content, limit=DISCORD_MSG_CHAR_LIMIT):
+    if len(content) <= limit:
+        return [content]
+
+    chunks = []
+    current = ""
+    fence = None
+
+    # Leave room to close and reopen a code block around every split
+    for line in _split_long_lines(content.splitlines(True), limit - 32):
+        closing = "\n" + CODE_FENCE if fence else ""
+
+        if current and len(current) + len(line) + len(closing) > limit:
+            chunks.append(current.rstrip("\n") + closing)
+            current = fence + "\n" if fence else ""
+
+        current += line
+
+        if line.count(CODE_FENCE) % 2:
+            fence = None if fence else _fence_header(line)
+
+    if current.strip():
+        chunks.append(current.rstrip("\n"))
+
+    return chunks
+
+class TokenBucket:
+    def __init__(self, rate, per):
+        self.capacity = rate
+        self.fill_rate = rate / per
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def delay(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / self.fill_rate
+
+    async def acquire(self, loop):
+        delay = self.delay()
+
+        while delay:
+            await asyncio.sleep(delay, loop=loop)
+            delay = self.delay()
+
+class OutboundMessage:
+    # One chunk of a message. All chunks of a message share its future,
+    # which the last one resolves.
+    __slots__ = ("content", "tts", "expire_in", "future", "last")
+
+    def __init__(self, content, tts, expire_in, future, last=True):
+        self.content = content
+        self.tts = tts
+        self.expire_in = expire_in
+        self.future = future
+        self.last = last
+
+    def can_merge(self, other):
+        return self.tts == other.tts and self.expire_in == other.expire_in
+
+class MessageSender:
+    # Queues outgoing messages per channel. Each channel drains through a
+    # token bucket matching Discord's per-channel message bucket plus a
+    # global one, splitting long content and merging short messages that
+    # are queued back to back.
+
+    def __init__(self, bot, *, rate=5, per=5.0, global_rate=50, global_per=1.0,
+                 limit=DISCORD_MSG_CHAR_LIMIT):
+        self.bot = bot
+        self.rate = rate
+        self.per = per
+        self.limit = limit
+        self.sent = 0
+        self.merged = 0
+        self.rate_limited = 0
+
+        self._queues = {}
+        self._workers = {}
+        self._buckets = {}
+        self._global = TokenBucket(global_rate, global_per)
+
+    def pending(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def send(self, dest, content, *, tts=False, expire_in=0):
+        queue = self._queues.setdefault(dest.id, deque())
+        future = self.bot.loop.create_future()
+        chunks = chunk_message(content, self.limit)
+
+        for i, chunk in enumerate(chunks, 1):
+            queue.append(OutboundMessage(chunk, tts, expire_in, future,
+                last=i == len(chunks)))
+
+        if dest.id not in self._workers:
+            self._workers[dest.id] = self.bot.loop.create_task(self._drain(dest))
+
+        return future
+
+    def _bucket(self, dest):
+        # Message creation is limited per channel by Discord
+        key = "channels/{0}/messages".format(dest.id)
+        bucket = self._buckets.get(key)
+
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.per)
+
+        return bucket
+
+    async def _drain(self, dest):
+        queue = self._queues[dest.id]
+        bucket = self._bucket(dest)
+
+        try:
+            while queue:
+                # The rest of a message whose earlier chunk failed is dropped
+                if queue[0].future.done():
+                    queue.popleft()
+                    continue
+
+                await bucket.acquire(self.bot.loop)
+                await self._global.acquire(self.bot.loop)
+
+                # Anything queued while we waited for the buckets can go out
+                # in the same message
+                batch = [queue.popleft()]
+                length = len(batch[0].content)
+
+                while queue and batch[0].can_merge(queue[0]) and \
+                        length + len(queue[0].content) + 1 <= self.limit:
+                    length += len(queue[0].content) + 1
+                    batch.append(queue.popleft())
+
+                self.merged += len(batch) - 1
+                content = "\n".join(m.content for m in batch)
+
+                try:
+                    msg = await self.bot.send_message_now(dest, content,
+                        tts=batch[0].tts, expire_in=batch[0].expire_in)
+                except Exception as e:
+                    for m in batch:
+                        if not m.future.done():
+                            m.future.set_exception(e)
+                    continue
+
+                self.sent += 1
+
+                for m in batch:
+                    if m.last and not m.future.done():
+                        m.future.set_result(msg)
+        finally:
+            self._workers.pop(dest.id, None)
+
+            if not queue:
+                self._queues.pop(dest.id, None)
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import json
+import time
+import logging
+
+import asyncio
+
+from .voice import is_healthy
+
+log = logging.getLogger(__name__)
+
+# How long a restore waits for the music library's first scan
+LIBRARY_TIMEOUT = 30.0
+
+class SessionStore:
+    # Checkpoints every server's voice channel and playback (song, position,
+    # volume and queue) so that a restart picks up where it left off. The
+    # sessions are rejoined concurrently once the bot is ready.
+
+    def __init__(self, bot, *, path=None, interval=5.0):
+        self.bot = bot
+        self.path = path
+        self.interval = interval
+        self.sessions = {}
+        self.restored = None
+        self.interrupted = {}
+
+        self._saved = None
+        self._restoring = False
+
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.sessions = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            log.warning("Session file {0} is corrupt, ignoring it".format(self.path))
+            return
+
+        self._saved = self.sessions
+
+    def capture(self):
+        # Until the saved sessions are restored they are still the truth
+        if self.restored is None:
+            return self.sessions
+
+        sessions = {}
+
+        for server_id, channel_id in self.bot.voice_manager.targets.items():
+            session = sessions[server_id] = {"channel": channel_id}
+            player = self.bot.players.get(server_id)
+
+            if player is not None and not player.is_done() and player.current is not None:
+                session.update(self._player_state(player))
+            elif server_id in self.interrupted:
+                session.update(self.interrupted[server_id])
+
+        self.sessions = sessions
+        return sessions
+
+    def _player_state(self, player):
+        return {
+            "track": player.current.name,
+            "position": round(player.position, 2),
+            "volume": player.volume,
+            "paused": player.is_paused(),
+            "queue": [t.name for t in player.upcoming()]
+        }
+
+    def interrupt(self, server, player):
+        # Playback cut off by a dropped voice connection carries on from
+        # the same spot once the voice manager has reconnected
+        if player.current is None or server.id not in self.bot.voice_manager.targets:
+            return
+
+        self.interrupted[server.id] = self._player_state(player)
+        self.resume_interrupted(server)
+
+    def resume_interrupted(self, server):
+        session = self.interrupted.get(server.id)
+        voice = self.bot.voice_client_in(server)
+
+        if session is None or voice is None or not is_healthy(voice):
+            return
+
+        del self.interrupted[server.id]
+        self._resume(voice.channel, voice, session)
+
+    def save(self):
+        if not self.path or self.sessions == self._saved:
+            return
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.sessions, f, separators=(",", ":"))
+
+        os.replace(tmp_path, self.path)
+        self._saved = self.sessions
+
+    def checkpoint(self):
+        self.capture()
+
+        try:
+            self.save()
+        except OSError as e:
+            log.error("Unable to save sessions: {0}".format(e))
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+
+        while True:
+            await asyncio.sleep(self.interval, loop=self.bot.loop)
+            self.checkpoint()
+
+    async def restore(self):
+        # on_ready fires again after a reconnect, only the first one counts
+        if self._restoring or self.restored is not None:
+            return
+
+        self._restoring = True
+        restored = 0
+
+        try:
+            restored = await self._restore(self.sessions)
+        finally:
+            # Checkpoints start once the saved sessions are back in place
+            self.restored = restored
+
+    async def _restore(self, sessions):
+        started = time.perf_counter()
+        restored = 0
+
+        if not sessions:
+            return 0
+
+        if any("track" in s for s in sessions.values()):
+            await self.bot.loop.run_in_executor(None,
+                self.bot.library.ready.wait, LIBRARY_TIMEOUT)
+
+        channels = []
+
+        for session in sessions.values():
+            channel = self.bot.get_channel(session["channel"])
+
+            if channel is None:
+                log.warning("Voice channel {0} is gone, not restoring its session".format(
+                    session["channel"]))
+                continue
+
+            channels.append(channel)
+
+        results = await self.bot.voice_manager.connect_many(channels)
+
+        for channel, voice in zip(channels, results):
+            if isinstance(voice, Exception):
+                continue
+
+            restored += 1
+            self._resume(channel, voice, sessions[channel.server.id])
+
+        log.info("Restored {0} of {1} sessions in {2:.1f}s".format(
+            restored, len(sessions), time.perf_counter() - started))
+
+        return restored
+
+    def _resume(self, channel, voice, session):
+        if "track" not in session or channel.server.id in self.bot.players:
+            return
+
+        library = self.bot.library
+        current = library.get(session["track"])
+        queue = [t for t in map(library.get, session["queue"]) if t is not None]
+        position = session["position"]
+
+        if current is None:
+            # The song was removed, carry on with the rest of the queue
+            if not queue:
+                return
+
+            current = queue.pop(0)
+            position = 0.0
+
+        player = self.bot.create_player(channel, voice, volume=session["volume"],
+            start_at=position)
+        player.enqueue(current)
+
+        for track in queue:
+            player.enqueue(track)
+
+        if session["paused"]:
+            player.pause()
+
+        player.start()
+        log.info("Resumed {0} on {1} at {2:.0f}s".format(current.title,
+            channel.server.name, position))
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import logging
+import threading
+import multiprocessing
+
+from multiprocessing.connection import Listener, Client
+
+import asyncio
+
+log = logging.getLogger(__name__)
+
+# A shard that has not reported for this long is left out of the totals
+SHARD_TIMEOUT = 30.0
+RESTART_DELAY = 5.0
+
+class Coordinator(threading.Thread):
+    # Runs in the launcher. Every shard reports its state over a local
+    # connection and gets back what the other shards reported.
+
+    def __init__(self, *, authkey=None):
+        super().__init__(name="ShardCoordinator", daemon=True)
+        self.authkey = authkey or os.urandom(32)
+        self.listener = Listener(authkey=self.authkey)
+        self.address = self.listener.address
+
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def run(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                break
+            except Exception:
+                log.exception("Rejected a shard connection")
+                continue
+
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def stop(self):
+        self.listener.close()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    kind, shard_id, state = conn.recv()
+                except (EOFError, OSError):
+                    break
+
+                if kind == "update":
+                    with self._lock:
+                        self._shards[shard_id] = (time.monotonic(), state)
+
+                conn.send(self.aggregate(exclude=shard_id))
+
+    def aggregate(self, exclude=None):
+        now = time.monotonic()
+
+        with self._lock:
+            shards = {k: s for k, (t, s) in self._shards.items()
+                      if now - t < SHARD_TIMEOUT}
+
+        songs = {}
+        owners = set()
+        totals = {"players": 0, "servers": 0, "messages": 0}
+
+        for shard_id, state in shards.items():
+            owners.update(state["owners"])
+
+            for key in totals:
+                totals[key] += state[key]
+
+            if shard_id != exclude:
+                for key, song in state["songs"].items():
+                    songs["{0}:{1}".format(shard_id, key)] = song
+
+        return {
+            "shards": sorted(shards),
+            "songs": songs,
+            "owners": sorted(owners),
+            "totals": totals
+        }
+
+class ShardLink:
+    # The shard's side of the coordinator connection
+
+    def __init__(self, bot, address, authkey, *, interval=2.0):
+        self.bot = bot
+        self.address = address
+        self.authkey = authkey
+        self.interval = interval
+        self.cluster = None
+
+        self._conn = None
+
+    def local_state(self):
+        bot = self.bot
+        owners = [i for i in bot.config.owner_id if bot.members.get(i) is not None]
+
+        return {
+            "songs": dict(bot.presence.songs),
+            "players": len(bot.players),
+            "servers": len(bot.servers),
+            "messages": bot.metrics.messages.value(),
+            "owners": owners
+        }
+
+    def _exchange(self, state):
+        if self._conn is None:
+            self._conn = Client(self.address, authkey=self.authkey)
+
+        try:
+            self._conn.send(("update", self.bot.shard_id, state))
+            return self._conn.recv()
+        except (EOFError, OSError):
+            self._conn.close()
+            self._conn = None
+            raise
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+
+        while True:
+            try:
+                self.cluster = await self.bot.loop.run_in_executor(None,
+                    self._exchange, self.local_state())
+            except (EOFError, OSError) as e:
+                log.warning("Lost the shard coordinator: {0}".format(e))
+            else:
+                self.bot.presence.set_remote(self.cluster["songs"])
+
+            await asyncio.sleep(self.interval, loop=self.bot.loop)
+
+def run_shard(config_file, shard_id, shard_count, address, authkey):
+    from .bot import VitasBot
+    from .config import Config
+
+    config = Config(config_file)
+
+    # Every shard has its own state files and metrics port, and an even
+    # share of the audio workers
+    if config.expiry_file:
+        config.expiry_file = "{0}.{1}".format(config.expiry_file, shard_id)
+
+    if config.session_file:
+        config.session_file = "{0}.{1}".format(config.session_file, shard_id)
+
+    if config.log_file:
+        config.log_file = "{0}.{1}".format(config.log_file, shard_id)
+
+    config.debug_log_file = "{0}.{1}".format(config.debug_log_file, shard_id)
+
+    if config.metrics_port:
+        config.metrics_port += shard_id
+
+    if config.audio_workers > 0:
+        config.audio_workers = max(1, config.audio_workers // shard_count)
+
+    bot = VitasBot(config, shard_id=shard_id, shard_count=shard_count,
+        coordinator=(address, authkey))
+    bot.run()
+
+def launch(config_file, shard_count):
+    coordinator = Coordinator()
+    coordinator.start()
+
+    def start(shard_id):
+        process = multiprocessing.Process(target=run_shard,
+            args=(config_file, shard_id, shard_count, coordinator.address,
+                  coordinator.authkey),
+            name="Shard-{0}".format(shard_id))
+        process.start()
+        log.info("Started shard {0}/{1} (pid {2})".format(
+            shard_id, shard_count, process.pid))
+        return process
+
+    processes = {}
+
+    try:
+        for shard_id in range(shard_count):
+            processes[shard_id] = start(shard_id)
+
+        while True:
+            time.sleep(1)
+
+            for shard_id, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+
+                if process.exitcode == 0:
+                    log.info("Shard {0} exited".format(shard_id))
+                    del processes[shard_id]
+                    continue
+
+                log.error("Shard {0} exited with {1}, restarting in {2:.0f}s".format(
+                    shard_id, process.exitcode, RESTART_DELAY))
+                time.sleep(RESTART_DELAY)
+                processes[shard_id] = start(shard_id)
+
+            if not processes:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes.values():
+            process.terminate()
+
+        for process in processes.values():
+            process.join(10)
+
+        coordinator.stop()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import logging
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+class StartupTimer:
+    # Seconds spent in each phase of starting the bot, from its construction
+    # to the first command it handles. Phases that run in the background
+    # overlap the others, so they do not add up to the total.
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = OrderedDict()
+        self.first_command = None
+
+        self._marks = {}
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases[name] = seconds
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def mark(self, name):
+        self._marks[name] = time.perf_counter()
+
+    def since(self, name):
+        # Records the time since mark(name) was called, as its own phase
+        started = self._marks.pop(name, None)
+
+        if started is None:
+            return None
+
+        seconds = time.perf_counter() - started
+        self.record(name, seconds)
+        return seconds
+
+    def command_handled(self):
+        if self.first_command is None:
+            self.first_command = self.elapsed()
+            log.info("First command handled {0:.2f}s after start".format(
+                self.first_command))
+
+    def summary(self):
+        with self._lock:
+            phases = list(self.phases.items())
+
+        return ", ".join("{0} {1:.2f}s".format(k, v) for k, v in phases)
+
+    def to_dict(self):
+        with self._lock:
+            phases = dict(self.phases)
+
+        return {
+            "phases": phases,
+            "first_command": self.first_command
+        }
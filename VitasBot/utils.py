@@ -1,7 +1,17 @@
+import os
+import json
+import time
 import inspect
 
+from contextlib import contextmanager
+
 from discord import opus
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 OPUS_LIBS = ['libopus-0.x86.dll', 'libopus-0.x64.dll', 'libopus-0.dll', 'libopus.so.0', 'libopus.0.dylib']
 
 def __func__():
@@ -21,4 +31,75 @@ def load_opus_lib(opus_libs=OPUS_LIBS):
 
     raise RuntimeError("Could not load an opus lib. Tried {0}".format(
         ", ".join(opus_libs)
-    ))
\ No newline at end of file
+    ))
+
+@contextmanager
+def file_lock(path):
+    # Advisory lock between the shard processes, where the OS has flock
+    if fcntl is None:
+        yield
+        return
+
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def update_json(path, update):
+    # Applies update() to what the file holds now and writes the result, so
+    # processes sharing the file keep each other's entries. Returns the
+    # merged data.
+    with file_lock(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            data = {}
+
+        data = update(data)
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+        os.replace(tmp_path, path)
+
+    return data
+
+class LogSampler:
+    # Token bucket in front of a logger, for messages that can arrive far
+    # faster than they are worth writing. Arguments are formatted lazily by
+    # the logger, so suppressed messages cost next to nothing.
+
+    def __init__(self, logger, *, rate=1.0, burst=5):
+        self.logger = logger
+        self.rate = rate
+        self.burst = burst
+        self.suppressed = 0
+
+        self._tokens = burst
+        self._last = time.monotonic()
+
+    def log(self, level, msg, *args):
+        if self.rate <= 0 or not self.logger.isEnabledFor(level):
+            return
+
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+        if self._tokens < 1:
+            self.suppressed += 1
+            return
+
+        self._tokens -= 1
+
+        if self.suppressed:
+            msg += " (%d similar messages suppressed)"
+            args += (self.suppressed,)
+            self.suppressed = 0
+
+        self.logger.log(level, msg, *args)
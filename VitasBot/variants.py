@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import sys
+import json
+import logging
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageSequence
+except ImportError:
+    Image = None
+
+from .logpipe import detach_queue
+from .opuscache import file_hash
+from .utils import update_json
+
+log = logging.getLogger(__name__)
+
+# Discord's upload limit for regular accounts
+UPLOAD_LIMIT = 8 * 1024 * 1024
+
+# Formats Pillow can decode; video files are served as they are
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif")
+
+MAX_DIMENSION = 1280
+SCALES = (1.0, 0.75, 0.5, 0.35)
+FRAME_STEPS = (1, 2, 3, 4)
+
+def _save(image, path, **options):
+    tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+    image.save(tmp_path, **options)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+def _fit(size, scale):
+    ratio = min(1.0, MAX_DIMENSION / max(size)) * scale
+    return max(1, int(size[0] * ratio)), max(1, int(size[1] * ratio))
+
+def _still_variants(image, base):
+    has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+    image = image.convert("RGBA" if has_alpha else "RGB")
+
+    for scale in SCALES:
+        resized = image.resize(_fit(image.size, scale), Image.LANCZOS)
+        label = "{0}.{1}".format(base, int(scale * 100))
+
+        yield _save(resized, label + ".webp", format="WEBP", quality=80, method=4), \
+            label + ".webp"
+
+        if not has_alpha:
+            yield _save(resized, label + ".jpg", format="JPEG", quality=85,
+                optimize=True, progressive=True), label + ".jpg"
+
+def _gif_variants(image, base):
+    frames = []
+    durations = []
+
+    for frame in ImageSequence.Iterator(image):
+        frames.append(frame.convert("RGBA"))
+        durations.append(frame.info.get("duration", 100))
+
+    for scale in SCALES:
+        size = _fit(image.size, scale)
+
+        # Dropping frames keeps the playback speed by stretching the rest
+        for step in FRAME_STEPS:
+            kept = [f.resize(size, Image.LANCZOS) for f in frames[::step]]
+            kept_durations = [sum(durations[i:i + step])
+                              for i in range(0, len(durations), step)]
+            path = "{0}.{1}.{2}.gif".format(base, int(scale * 100), step)
+
+            yield _save(kept[0], path, format="GIF", save_all=True,
+                append_images=kept[1:], duration=kept_durations,
+                loop=image.info.get("loop", 0), optimize=True), path
+
+def build_variants(path, directory, limit=UPLOAD_LIMIT):
+    # Runs in a worker process. Variants are produced from largest to
+    # smallest and generation stops at the first that fits the limit.
+    digest = file_hash(path)
+    original = os.path.getsize(path)
+    variants = []
+
+    if Image is None:
+        return digest, variants
+
+    base = os.path.join(directory, digest)
+
+    with Image.open(path) as image:
+        if not getattr(image, "is_animated", False):
+            generated = _still_variants(image, base)
+        elif image.format == "GIF":
+            generated = _gif_variants(image, base)
+        else:
+            return digest, variants
+
+        for size, variant in generated:
+            if size >= original:
+                os.remove(variant)
+                continue
+
+            variants.append([os.path.basename(variant), size])
+
+            if size <= limit:
+                break
+
+    return digest, variants
+
+def _build_in_worker(path, directory, limit):
+    # Python 3.6 pools have no initializer, so every task resets the logging
+    detach_queue()
+    return build_variants(path, directory, limit)
+
+class VariantStore:
+    # Smaller re-encodes of the pictures, made in a process pool so the
+    # bot's loop never waits on image encoding.
+
+    def __init__(self, directory, *, limit=UPLOAD_LIMIT, workers=2):
+        self.directory = directory
+        self.limit = limit
+        self.workers = workers
+        self.index_path = os.path.join(directory, "index.json")
+
+        self._sources = {}
+        self._variants = {}
+        self._index_mtime = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._reload()
+
+    def _reload(self):
+        # Shards share the variants, pick up what the others have made
+        try:
+            mtime = os.stat(self.index_path).st_mtime
+
+            if mtime == self._index_mtime:
+                return
+
+            with open(self.index_path, encoding="utf-8") as f:
+                index = json.load(f)
+
+            self._sources = index["sources"]
+            self._variants = index["variants"]
+            self._index_mtime = mtime
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError):
+            log.warning("Picture variant index {0} is corrupt, starting empty".format(
+                self.index_path))
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def _current(self, picture):
+        entry = self._sources.get(picture.name)
+
+        if entry is None or entry[:2] != [picture.size, picture.mtime]:
+            self._reload()
+            entry = self._sources.get(picture.name)
+
+            if entry is None or entry[:2] != [picture.size, picture.mtime]:
+                return None
+
+        return entry[2]
+
+    def best(self, picture):
+        # Smallest file of the picture that fits the upload limit, the
+        # original itself whenever it does
+        if picture.size <= self.limit:
+            return picture.path
+
+        best_path, best_size = picture.path, picture.size
+        digest = self._current(picture)
+
+        for name, size in self._variants.get(digest, ()):
+            path = os.path.join(self.directory, name)
+
+            if size < best_size and os.path.isfile(path):
+                best_path, best_size = path, size
+
+        return best_path if best_size <= self.limit else None
+
+    def start(self):
+        # Forks the worker processes, which has to happen before the bot
+        # starts any threads. Python 3.6 pools fork every worker on the
+        # first task, so an empty one is sent right away
+        if self._executor is None and self.available:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._executor.submit(int).result()
+
+    def request(self, picture):
+        # Returns whether variants of the picture are on their way
+        if self._executor is None or self._current(picture) is not None or \
+                picture.size <= self.limit or \
+                not picture.name.lower().endswith(EXTENSIONS):
+            return False
+
+        with self._lock:
+            if picture.name in self._pending:
+                return True
+
+            self._pending.add(picture.name)
+
+        future = self._executor.submit(_build_in_worker, picture.path,
+            self.directory, self.limit)
+        future.add_done_callback(lambda f: self._store(picture, f))
+        return True
+
+    def request_all(self, pictures):
+        for picture in pictures:
+            self.request(picture)
+
+    def _store(self, picture, future):
+        with self._lock:
+            self._pending.discard(picture.name)
+
+            try:
+                digest, variants = future.result()
+            except Exception as e:
+                log.error("Failed to make variants of {0}: {1}".format(picture.name, e))
+                return
+
+            source = [picture.size, picture.mtime, digest]
+
+            def update(index):
+                index.setdefault("sources", {})[picture.name] = source
+                index.setdefault("variants", {})[digest] = variants
+                return index
+
+            try:
+                index = update_json(self.index_path, update)
+            except OSError as e:
+                log.error("Unable to save picture variant index: {0}".format(e))
+            else:
+                self._sources = index["sources"]
+                self._variants = index["variants"]
+
+        log.debug("Made {0} variants of {1}".format(len(variants), picture.name))
+
+    def stop(self, wait=False):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+def main(argv=None):
+    from .pictures import PictureLibrary
+
+    argv = sys.argv[1:] if argv is None else argv
+
+    if len(argv) != 2:
+        print("Usage: python -m VitasBot.variants <pictures_dir> <variants_dir>")
+        return 2
+
+    logging.basicConfig(level=logging.INFO)
+
+    if Image is None:
+        log.error("Pillow is required to make picture variants")
+        return 1
+
+    library = PictureLibrary(argv[0])
+    library.rescan()
+    store = VariantStore(argv[1], workers=os.cpu_count())
+    store.start()
+    store.request_all(library.pictures())
+
+    store.stop(wait=True)
+
+    log.info("{0} pictures processed".format(len(library)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
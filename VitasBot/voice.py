@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import random
+import logging
+
+import asyncio
+
+from collections import defaultdict, deque
+
+from discord import InvalidArgument
+from discord.enums import ChannelType
+
+log = logging.getLogger(__name__)
+
+def is_healthy(voice):
+    ws = getattr(voice, "ws", None)
+    return voice.is_connected() and ws is not None and getattr(ws, "open", True)
+
+class VoiceManager:
+    # Owns the voice connections. Connections are made concurrently up to a
+    # limit, reused or moved when one already exists for the server, and
+    # re-established with backoff when they drop.
+
+    def __init__(self, bot, *, concurrency=5, timeout=15.0, check_interval=5.0,
+                 backoff=1.0, max_backoff=60.0):
+        self.bot = bot
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.latencies = deque(maxlen=100)
+        self.reconnects = 0
+
+        self._semaphore = asyncio.Semaphore(concurrency, loop=bot.loop)
+        self._locks = defaultdict(lambda: asyncio.Lock(loop=bot.loop))
+        self._targets = {}
+        self._reconnecting = {}
+
+    @property
+    def targets(self):
+        return dict(self._targets)
+
+    async def connect(self, channel):
+        if getattr(channel, "type", None) != ChannelType.voice:
+            raise InvalidArgument("Channel passed must be a voice channel")
+
+        server = channel.server
+        self._targets[server.id] = channel.id
+
+        async with self._locks[server.id]:
+            voice = self.bot.voice_client_in(server)
+
+            if voice is not None and is_healthy(voice):
+                if voice.channel is None or voice.channel.id != channel.id:
+                    log.debug("Moving to {0} on {1}".format(channel.name, server.name))
+                    await voice.move_to(channel)
+
+                return voice
+
+            if voice is not None:
+                await self._teardown(voice)
+
+            async with self._semaphore:
+                started = time.perf_counter()
+                voice = await self.bot.join_voice_channel(channel, timeout=self.timeout)
+                self.latencies.append(time.perf_counter() - started)
+
+        # A player outlives the connection it started on. One that already
+        # stopped because the connection dropped is started again instead
+        player = self.bot.players.get(server.id)
+
+        if player is not None and player.is_alive() and not player.disconnected:
+            player.voice = voice
+        else:
+            self.bot.sessions.resume_interrupted(server)
+
+        return voice
+
+    async def connect_many(self, channels):
+        results = await asyncio.gather(*[self.connect(c) for c in channels],
+            loop=self.bot.loop, return_exceptions=True)
+
+        for channel, result in zip(channels, results):
+            if isinstance(result, Exception):
+                log.error("Unable to join {0} on {1}: {2!r}".format(
+                    channel.name, channel.server.name, result))
+
+        return results
+
+    async def disconnect(self, server):
+        self._targets.pop(server.id, None)
+        self.bot.sessions.interrupted.pop(server.id, None)
+        task = self._reconnecting.pop(server.id, None)
+
+        if task is not None:
+            task.cancel()
+
+        voice = self.bot.voice_client_in(server)
+
+        if voice is not None:
+            async with self._locks[server.id]:
+                await self._teardown(voice)
+
+    async def _teardown(self, voice):
+        server_id = voice.server.id
+
+        try:
+            await asyncio.wait_for(voice.disconnect(), 5, loop=self.bot.loop)
+        except Exception:
+            pass
+
+        # A failed disconnect leaves the client registered, which blocks
+        # joining the server again
+        self.bot.connection._remove_voice_client(server_id)
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+
+        while True:
+            await asyncio.sleep(self.check_interval, loop=self.bot.loop)
+
+            for server_id, channel_id in list(self._targets.items()):
+                voice = self.bot.connection._get_voice_client(server_id)
+
+                if voice is not None and is_healthy(voice):
+                    continue
+
+                if server_id not in self._reconnecting:
+                    self._reconnecting[server_id] = self.bot.loop.create_task(
+                        self._reconnect(server_id, channel_id))
+
+    async def _reconnect(self, server_id, channel_id):
+        attempt = 0
+
+        try:
+            while self._targets.get(server_id) == channel_id:
+                channel = self.bot.get_channel(channel_id)
+
+                if channel is None:
+                    log.warning("Voice channel {0} is gone, not reconnecting".format(
+                        channel_id))
+                    self._targets.pop(server_id, None)
+                    break
+
+                try:
+                    await self.connect(channel)
+                except InvalidArgument:
+                    log.warning("{0} is not a voice channel, not reconnecting".format(
+                        channel.name))
+                    self._targets.pop(server_id, None)
+                    break
+                except Exception as e:
+                    delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                    delay *= random.uniform(0.5, 1.0)
+                    attempt += 1
+
+                    log.warning("Reconnecting to {0} failed ({1!r}), retrying in "
+                        "{2:.1f}s".format(channel.name, e, delay))
+                    await asyncio.sleep(delay, loop=self.bot.loop)
+                else:
+                    self.reconnects += 1
+                    log.info("Reconnected to {0} on {1}".format(
+                        channel.name, channel.server.name))
+                    break
+        finally:
+            self._reconnecting.pop(server_id, None)
+
+    def to_dict(self):
+        latencies = sorted(self.latencies)
+
+        return {
+            "connections": len(self._targets),
+            "reconnects": self.reconnects,
+            "connect_p50": latencies[len(latencies) // 2] if latencies else None,
+            "connect_max": latencies[-1] if latencies else None
+        }
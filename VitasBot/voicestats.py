@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from bisect import bisect_left
+
+# Bucket upper bounds in milliseconds
+INTERVAL_BUCKETS = (5, 10, 15, 18, 19, 20, 21, 22, 25, 30, 40, 60, 100, 250)
+DECODE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50)
+FIRST_AUDIO_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# A frame is late when sent this long after its due time, a sleep when it
+# wakes this long after it should
+LATE_THRESHOLD = 5.0
+OVERSLEEP_THRESHOLD = 2.0
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+
+            if seen >= rank:
+                return bound
+
+        return self.max
+
+    def to_dict(self):
+        return {
+            "bounds": list(self.bounds),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max
+        }
+
+class FrameStats:
+    # Timing of one server's audio. Updated from the player thread with a
+    # few additions per frame and read from the loop without locking; a
+    # slightly torn read only skews a counter by a frame.
+
+    def __init__(self):
+        self.intervals = Histogram(INTERVAL_BUCKETS)
+        self.decode = Histogram(DECODE_BUCKETS)
+        self.first_audio = Histogram(FIRST_AUDIO_BUCKETS)
+        self.frames = 0
+        self.late = 0
+        self.dropped = 0
+        self.oversleeps = 0
+        self.tracks = 0
+
+        self._last_sent = None
+        self._opened = None
+
+    def track_opened(self, now):
+        self._opened = now
+        self.tracks += 1
+
+    def decoded(self, seconds):
+        self.decode.observe(seconds * 1000)
+
+    def frame_sent(self, now, due):
+        self.frames += 1
+
+        if self._opened is not None:
+            self.first_audio.observe((now - self._opened) * 1000)
+            self._opened = None
+
+        if self._last_sent is not None:
+            self.intervals.observe((now - self._last_sent) * 1000)
+
+        self._last_sent = now
+
+        if (now - due) * 1000 > LATE_THRESHOLD:
+            self.late += 1
+
+    def slept(self, overshoot):
+        if overshoot * 1000 > OVERSLEEP_THRESHOLD:
+            self.oversleeps += 1
+
+    def skipped(self, frames):
+        self.dropped += frames
+
+    def paused(self):
+        # Time spent paused is not a gap in the cadence
+        self._last_sent = None
+
+    def summary(self):
+        late = self.late / self.frames * 100 if self.frames else 0.0
+
+        return ("frames {0.frames}, late {0.late} ({1:.2f}%), dropped {0.dropped}, "
+                "late wakeups {0.oversleeps}\n"
+                "    interval p50 {2}ms p99 {3}ms max {0.intervals.max:.1f}ms\n"
+                "    decode avg {0.decode.mean:.2f}ms max {0.decode.max:.1f}ms\n"
+                "    first audio avg {0.first_audio.mean:.0f}ms "
+                "max {0.first_audio.max:.0f}ms over {0.tracks} songs").format(
+                self, late, self.intervals.percentile(0.5),
+                self.intervals.percentile(0.99))
+
+    def to_dict(self):
+        return {
+            "frames": self.frames,
+            "late": self.late,
+            "dropped": self.dropped,
+            "oversleeps": self.oversleeps,
+            "tracks": self.tracks,
+            "interval_ms": self.intervals.to_dict(),
+            "decode_ms": self.decode.to_dict(),
+            "first_audio_ms": self.first_audio.to_dict()
+        }
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2017 Marcus Kainth
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import glob
+import mmap
+import time
+import signal
+import struct
+import logging
+import itertools
+import tempfile
+import threading
+import multiprocessing
+
+from discord import opus
+
+from .player import FFmpegSource, FRAME_SIZE
+from .opuscache import SAMPLING_RATE, CHANNELS
+
+log = logging.getLogger(__name__)
+
+# Ring layout: the producer owns the write counter and its state byte, the
+# consumer owns the read counter and its state byte, so neither side ever
+# writes a field the other one writes
+COUNTER = struct.Struct("<Q")
+WRITE_OFFSET = 0
+READ_OFFSET = 8
+PRODUCER_STATE = 16
+CONSUMER_STATE = 17
+HEADER_SIZE = 24
+
+SLOT_HEADER = struct.Struct("<H")
+# An encoded frame never exceeds the PCM frame it came from
+SLOT_SIZE = SLOT_HEADER.size + FRAME_SIZE
+
+RUNNING = 0
+FINISHED = 1
+FAILED = 2
+CLOSED = 1
+
+POLL_INTERVAL = 0.002
+
+def _ring_directory():
+    # Backed by RAM on Linux
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+class FrameRing:
+    # Single producer, single consumer ring of opus frames in a memory
+    # mapped file shared between the bot and a worker process.
+
+    def __init__(self, path, slots, *, create=False):
+        self.path = path
+        self.slots = slots
+        size = HEADER_SIZE + slots * SLOT_SIZE
+
+        if create:
+            with open(path, "wb") as f:
+                f.truncate(size)
+
+        with open(path, "r+b") as f:
+            self._map = mmap.mmap(f.fileno(), size)
+
+    def _counter(self, offset):
+        return COUNTER.unpack_from(self._map, offset)[0]
+
+    def _slot(self, index):
+        return HEADER_SIZE + (index % self.slots) * SLOT_SIZE
+
+    @property
+    def producer_state(self):
+        return self._map[PRODUCER_STATE]
+
+    @property
+    def closed(self):
+        return self._map[CONSUMER_STATE] == CLOSED
+
+    def __len__(self):
+        return self._counter(WRITE_OFFSET) - self._counter(READ_OFFSET)
+
+    def put(self, frame):
+        # Blocks while the ring is full. Returns False once the consumer
+        # has gone away
+        write = self._counter(WRITE_OFFSET)
+
+        while write - self._counter(READ_OFFSET) >= self.slots:
+            if self.closed:
+                return False
+
+            time.sleep(POLL_INTERVAL)
+
+        offset = self._slot(write)
+        SLOT_HEADER.pack_into(self._map, offset, len(frame))
+        self._map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(frame)] = frame
+
+        # Publish the frame only after it has been written
+        COUNTER.pack_into(self._map, WRITE_OFFSET, write + 1)
+        return not self.closed
+
+    def get(self):
+        read = self._counter(READ_OFFSET)
+
+        if read == self._counter(WRITE_OFFSET):
+            return None
+
+        offset = self._slot(read)
+        length, = SLOT_HEADER.unpack_from(self._map, offset)
+        start = offset + SLOT_HEADER.size
+        frame = self._map[start:start + length]
+
+        COUNTER.pack_into(self._map, READ_OFFSET, read + 1)
+        return frame
+
+    def finish(self, state=FINISHED):
+        self._map[PRODUCER_STATE] = state
+
+    def close(self, *, unlink=False):
+        if unlink:
+            self._map[CONSUMER_STATE] = CLOSED
+
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+        self._map.close()
+
+def _encode_stream(path, ring_path, slots, volume, before_options, options):
+    try:
+        ring = FrameRing(ring_path, slots)
+    except FileNotFoundError:
+        # Closed by the bot before the stream even started
+        return
+
+    source = None
+
+    try:
+        source = FFmpegSource(path, before_options=before_options,
+            options=options, volume=volume)
+        encoder = opus.Encoder(SAMPLING_RATE, CHANNELS)
+
+        while True:
+            pcm = source.read()
+
+            if not pcm:
+                break
+
+            if not ring.put(encoder.encode(pcm, encoder.samples_per_frame)):
+                break
+
+        ring.finish()
+    except Exception:
+        log.exception("Failed to encode {0}".format(path))
+        ring.finish(FAILED)
+    finally:
+        if source is not None:
+            source.close()
+
+        ring.close()
+
+def _worker_main(commands):
+    from .logpipe import detach_queue
+    from .utils import load_opus_lib
+
+    # Ctrl+C reaches the whole process group, the bot stops us itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    detach_queue()
+    load_opus_lib()
+
+    while True:
+        item = commands.get()
+
+        if item is None:
+            break
+
+        threading.Thread(target=_encode_stream, args=item, daemon=True).start()
+
+class WorkerSource:
+    encoded = True
+
+    def __init__(self, pool, worker, ring):
+        self.pool = pool
+        self.worker = worker
+        self.ring = ring
+        self._closed = False
+
+    def read(self):
+        while not self._closed:
+            frame = self.ring.get()
+
+            if frame is not None:
+                return frame
+
+            if self.ring.producer_state != RUNNING:
+                # The last frames may have landed after our check
+                return self.ring.get() or b""
+
+            if not self.pool.is_alive(self.worker):
+                log.error("Audio worker {0} exited".format(self.worker))
+                return b""
+
+            time.sleep(POLL_INTERVAL)
+
+        return b""
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        self.ring.close(unlink=True)
+        self.pool.release(self.worker)
+
+class AudioWorkers:
+    # Decodes and encodes songs in worker processes, one thread per stream
+    # in each worker, so the bot's own interpreter only paces and sends the
+    # finished frames.
+
+    def __init__(self, processes=None, *, slots=100):
+        self.processes = processes or os.cpu_count() or 1
+        self.slots = slots
+
+        self._workers = []
+        self._streams = []
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._directory = _ring_directory()
+
+    def __len__(self):
+        return sum(self._streams)
+
+    def start(self):
+        if self._workers:
+            return
+
+        for i in range(self.processes):
+            commands = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_worker_main, args=(commands,),
+                name="AudioWorker-{0}".format(i), daemon=True)
+            process.start()
+
+            self._workers.append((process, commands))
+            self._streams.append(0)
+
+        log.debug("Started {0} audio workers".format(self.processes))
+
+    def stop(self):
+        for process, commands in self._workers:
+            commands.put(None)
+
+        for process, commands in self._workers:
+            process.join(1)
+
+            if process.is_alive():
+                process.terminate()
+
+        with self._lock:
+            self._workers = []
+            self._streams = []
+
+        # Rings of players that were still open when the workers stopped
+        for ring_path in glob.glob(os.path.join(self._directory,
+                "vitasbot-{0}-*.ring".format(os.getpid()))):
+            try:
+                os.remove(ring_path)
+            except OSError:
+                pass
+
+    def is_alive(self, worker):
+        # Players may still be closing after the workers were stopped
+        workers = self._workers
+        return worker < len(workers) and workers[worker][0].is_alive()
+
+    def release(self, worker):
+        with self._lock:
+            if worker < len(self._streams):
+                self._streams[worker] -= 1
+
+    def open(self, path, *, volume=1.0, before_options=None, options=None):
+        with self._lock:
+            if not self._workers:
+                raise RuntimeError("The audio workers are not running")
+
+            worker = min(range(len(self._workers)), key=self._streams.__getitem__)
+            self._streams[worker] += 1
+
+        ring_path = os.path.join(self._directory, "vitasbot-{0}-{1}.ring".format(
+            os.getpid(), next(self._ids)))
+
+        try:
+            ring = FrameRing(ring_path, self.slots, create=True)
+            self._workers[worker][1].put((path, ring_path, self.slots, volume,
+                before_options, options))
+        except Exception:
+            self.release(worker)
+            raise
+
+        return WorkerSource(self, worker, ring)
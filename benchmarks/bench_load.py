@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+
+"""
+End to end load test: runs VitasBot against the fake Discord in
+benchmarks/fakediscord.py, each in its own process, and drives
+
+  - a flood of chat messages, mostly not commands
+  - concurrent commands across servers, timed from the gateway event to
+    the bot's reply
+  - joining voice and starting a song on many servers at once
+  - presence churn from pausing and resuming every player
+
+It reports throughput, command latency, event loop lag and voice frame
+timing. Save a run with --json and compare a later one with --baseline.
+Needs ffmpeg and libopus, as the bot does.
+
+Usage:
+    python -m benchmarks.bench_load [--guilds N] [--voice N] [--json FILE]
+                                    [--baseline FILE]
+"""
+
+import os
+import re
+import json
+import math
+import time
+import wave
+import array
+import shutil
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+
+import aiohttp
+
+from benchmarks import fakediscord
+
+SAMPLE_RATE = 48000
+TONES = (220.0, 330.0, 440.0)
+BOT_READY_TIMEOUT = 120.0
+
+def make_music(directory, seconds):
+    os.makedirs(directory, exist_ok=True)
+
+    for frequency in TONES:
+        # Whole periods of the tone, repeated
+        period = int(SAMPLE_RATE / frequency)
+        frames = array.array("h")
+
+        for i in range(period):
+            sample = int(8000 * math.sin(2 * math.pi * i / period))
+            frames.extend((sample, sample))
+
+        with wave.open(os.path.join(directory, "tone {0:.0f}.wav".format(frequency)), "wb") as f:
+            f.setnchannels(2)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes(frames.tobytes() * int(seconds * SAMPLE_RATE / period))
+
+def run_bot(base_url, workdir, metrics_port, audio_workers):
+    fakediscord.patch_client(base_url)
+
+    from VitasBot.bot import VitasBot
+    from VitasBot.config import ConfigDefaults
+
+    config = ConfigDefaults()
+    config.token = "fake-token"
+    config.owner_id = frozenset([fakediscord.OWNER_ID])
+    config.command_prefix = "!"
+    config.music_dir = os.path.join(workdir, "music")
+    config.library_index = os.path.join(workdir, "library.json")
+    config.normalize = False
+    config.opus_cache_dir = ""
+    config.audio_workers = audio_workers
+    config.pictures_dir = os.path.join(workdir, "pictures")
+    config.picture_cache_file = os.path.join(workdir, "pictures.json")
+    config.picture_variant_dir = ""
+    config.expiry_file = os.path.join(workdir, "expiries.json")
+    config.session_file = ""
+    config.metrics_port = metrics_port
+    config.debug_mode = False
+    config.debug_level = "WARNING"
+
+    VitasBot(config).run()
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))] if samples else None
+
+def parse_metrics(text):
+    samples = {}
+
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value.replace("+Inf", "inf"))
+
+    return samples
+
+def histogram_delta(before, after, name):
+    # Bucket counts added between two scrapes, as (upper bound, count)
+    pattern = re.compile(re.escape(name) + r'_bucket\{le="([^"]+)"\}')
+    buckets = []
+
+    for key, value in after.items():
+        match = pattern.fullmatch(key)
+
+        if match:
+            buckets.append((float(match.group(1)), value - before.get(key, 0)))
+
+    return sorted(buckets)
+
+def histogram_percentile(buckets, q):
+    if not buckets or not buckets[-1][1]:
+        return None
+
+    rank = q * buckets[-1][1]
+
+    for bound, count in buckets:
+        if count >= rank:
+            return bound
+
+class LoadTest:
+    def __init__(self, args, loop):
+        self.args = args
+        self.loop = loop
+        self.control = "http://127.0.0.1:{0}/_control".format(args.port)
+        self.bot_url = "http://127.0.0.1:{0}".format(args.metrics_port)
+        self.session = aiohttp.ClientSession(loop=loop)
+        self.guilds = []
+        self.results = {}
+
+    async def get(self, url):
+        async with self.session.get(url) as r:
+            return await r.text()
+
+    async def post(self, path, body=None):
+        async with self.session.post(self.control + path, data=json.dumps(body or {}),
+                headers={"Content-Type": "application/json"}) as r:
+            if r.status != 200:
+                raise RuntimeError("{0} returned {1}: {2}".format(path, r.status,
+                    await r.text()))
+
+            return await r.json()
+
+    async def state(self):
+        return json.loads(await self.get(self.control + "/state"))
+
+    async def bot_metrics(self):
+        return parse_metrics(await self.get(self.bot_url + "/metrics"))
+
+    async def bot_stats(self):
+        return json.loads(await self.get(self.bot_url + "/stats"))
+
+    async def command(self, guild, content, wait="reply", timeout=30):
+        result = await self.post("/command", {"channel_id": guild["text"],
+            "content": content, "wait": wait, "timeout": timeout})
+        return result["latency"]
+
+    async def command_all(self, guilds, content, wait="reply"):
+        semaphore = asyncio.Semaphore(self.args.concurrency, loop=self.loop)
+
+        async def one(guild):
+            async with semaphore:
+                return await self.command(guild, content.format(**guild), wait)
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*[one(g) for g in guilds], loop=self.loop)
+        elapsed = time.perf_counter() - started
+        done = [l for l in latencies if l is not None]
+
+        return {
+            "count": len(guilds),
+            "timeouts": len(guilds) - len(done),
+            "per_second": len(done) / elapsed,
+            "p50_ms": percentile(done, 0.5) * 1000 if done else None,
+            "p99_ms": percentile(done, 0.99) * 1000 if done else None
+        }
+
+    async def phase(self, name, coro):
+        before = await self.bot_metrics()
+        started = time.perf_counter()
+        result = await coro
+        after = await self.bot_metrics()
+
+        lag = histogram_delta(before, after, "vitasbot_loop_lag_histogram_seconds")
+        result["seconds"] = time.perf_counter() - started
+        result["loop_lag_p50_ms"] = (histogram_percentile(lag, 0.5) or 0) * 1000
+        result["loop_lag_p99_ms"] = (histogram_percentile(lag, 0.99) or 0) * 1000
+        result["loop_stalls"] = after.get("vitasbot_loop_stalls_total", 0) - \
+            before.get("vitasbot_loop_stalls_total", 0)
+
+        self.results[name] = result
+        print("  {0:<10} {1}".format(name, ", ".join(
+            "{0} {1}".format(k, _format(v)) for k, v in sorted(result.items()))))
+
+    async def wait_ready(self):
+        self.guilds = json.loads(await self.get(self.control + "/guilds"))
+        deadline = time.monotonic() + BOT_READY_TIMEOUT
+
+        while time.monotonic() < deadline:
+            # The fake refuses messages until the bot is on the gateway
+            try:
+                if await self.command(self.guilds[0], "!ping", timeout=2) is not None:
+                    return
+            except RuntimeError:
+                pass
+
+            await asyncio.sleep(0.5, loop=self.loop)
+
+        raise RuntimeError("The bot did not come up")
+
+    async def flood(self):
+        contents = ["hello there", "anyone around?", "!ping"]
+        before = (await self.bot_metrics()).get("vitasbot_messages_total", 0)
+        started = time.perf_counter()
+        await self.post("/flood", {"count": self.args.messages, "contents": contents})
+
+        while True:
+            seen = (await self.bot_metrics()).get("vitasbot_messages_total", 0) - before
+
+            if seen >= self.args.messages:
+                break
+
+            await asyncio.sleep(0.05, loop=self.loop)
+
+        return {"count": self.args.messages,
+                "per_second": self.args.messages / (time.perf_counter() - started)}
+
+    async def voice(self):
+        guilds = self.guilds[:self.args.voice]
+        await self.post("/reset")
+
+        result = {"join_" + k: v for k, v in
+                  (await self.command_all(guilds, "!join {voice}", "voice_connect")).items()}
+        result.update({"play_" + k: v for k, v in
+                      (await self.command_all(guilds, "!play", "audio")).items()})
+
+        await asyncio.sleep(self.args.play_seconds, loop=self.loop)
+
+        sink = (await self.state())["voice"]
+        frames = (await self.bot_stats())["voice"].values()
+        sent = sum(f["frames"] for f in frames)
+
+        result.update({
+            "frames": sink["packets"],
+            "frame_p50_ms": sink["interval_p50_ms"],
+            "frame_p99_ms": sink["interval_p99_ms"],
+            "frame_max_ms": sink["interval_max_ms"],
+            "late_pct": sink["late"] / max(1, sink["packets"]) * 100,
+            "dropped": sum(f["dropped"] for f in frames),
+            "sent": sent
+        })
+        return result
+
+    async def presence(self):
+        guilds = self.guilds[:self.args.voice]
+        before = (await self.state())["counters"].get("status_updates", 0)
+
+        for i in range(self.args.churn):
+            await self.command_all(guilds, "!pause", "none")
+            await asyncio.sleep(0.5, loop=self.loop)
+            await self.command_all(guilds, "!resume", "none")
+            await asyncio.sleep(0.5, loop=self.loop)
+
+        # Let the debounced update go out
+        await asyncio.sleep(2, loop=self.loop)
+        updates = (await self.state())["counters"].get("status_updates", 0) - before
+
+        return {"changes": 2 * len(guilds) * self.args.churn, "updates": updates}
+
+    async def run(self):
+        try:
+            await self.wait_ready()
+            print("{0} servers, bot ready".format(len(self.guilds)))
+
+            await self.phase("flood", self.flood())
+            await self.phase("commands", self.command_all(
+                [self.guilds[i % len(self.guilds)] for i in range(self.args.commands)],
+                "!ping"))
+
+            if self.args.voice:
+                await self.phase("voice", self.voice())
+                await self.phase("presence", self.presence())
+                await self.command_all(self.guilds[:self.args.voice], "!leave", "none")
+        finally:
+            self.session.close()
+
+        return self.results
+
+def _format(value):
+    return "{0:.2f}".format(value) if isinstance(value, float) else str(value)
+
+def compare(results, baseline):
+    print("\nAgainst the baseline:")
+
+    for phase, values in sorted(results.items()):
+        for key, value in sorted(values.items()):
+            old = baseline.get(phase, {}).get(key)
+
+            if not isinstance(value, (int, float)) or not old:
+                continue
+
+            print("  {0:<10} {1:<20} {2:>12} {3:>12} {4:+8.1f}%".format(phase, key,
+                _format(old), _format(value), (value - old) / old * 100))
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test VitasBot against a fake Discord")
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--commands", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--voice", type=int, default=50,
+        help="servers that join voice and play")
+    parser.add_argument("--play-seconds", type=float, default=10.0)
+    parser.add_argument("--churn", type=int, default=3,
+        help="rounds of pausing and resuming every player")
+    parser.add_argument("--audio-workers", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--metrics-port", type=int, default=9190)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare with results saved by --json")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="vitasbot-bench-")
+    make_music(os.path.join(workdir, "music"), args.play_seconds + 30)
+
+    ready = multiprocessing.Event()
+    fake = multiprocessing.Process(target=fakediscord.serve,
+        args=(args.guilds, args.port, ready), daemon=True)
+    fake.start()
+    ready.wait(30)
+
+    bot = multiprocessing.Process(target=run_bot, args=("http://127.0.0.1:{0}".format(
+        args.port), workdir, args.metrics_port, args.audio_workers), daemon=True)
+    bot.start()
+
+    loop = asyncio.get_event_loop()
+
+    try:
+        results = loop.run_until_complete(LoadTest(args, loop).run())
+    finally:
+        bot.terminate()
+        fake.terminate()
+        bot.join(10)
+        fake.join(10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
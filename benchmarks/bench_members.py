@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+Member lookup by id: linear scan over every member versus MemberIndex.
+
+Usage:
+    python -m benchmarks.bench_members [members] [servers]
+"""
+
+import sys
+import time
+import random
+
+import discord
+
+from VitasBot.members import MemberIndex
+
+class FakeServer:
+    def __init__(self, server_id):
+        self.id = server_id
+        self.members = []
+
+class FakeMember:
+    def __init__(self, member_id, server):
+        self.id = member_id
+        self.server = server
+        self.voice_channel = None
+
+def make_servers(members, servers, seed=0):
+    rng = random.Random(seed)
+    result = [FakeServer(str(i)) for i in range(servers)]
+
+    for i in range(members):
+        server = rng.choice(result)
+        server.members.append(FakeMember(str(10 ** 17 + i), server))
+
+    return result
+
+def timed(func, ids):
+    t1 = time.perf_counter()
+
+    for user_id in ids:
+        func(user_id)
+
+    return (time.perf_counter() - t1) / len(ids) * 1000
+
+def main():
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    servers = make_servers(members, count)
+
+    def all_members():
+        for server in servers:
+            yield from server.members
+
+    def scan(user_id):
+        return discord.utils.find(lambda m: m.id == user_id, all_members())
+
+    index = MemberIndex()
+    t1 = time.perf_counter()
+    index.rebuild(servers)
+    build = (time.perf_counter() - t1) * 1000
+
+    rng = random.Random(1)
+    ids = [str(10 ** 17 + rng.randrange(members)) for i in range(200)]
+
+    print("{0} members on {1} servers (index build {2:.1f}ms)".format(
+        members, count, build))
+    print("  linear scan   {0:10.4f}ms per lookup".format(timed(scan, ids[:20])))
+    print("  MemberIndex   {0:10.4f}ms per lookup".format(timed(index.get, ids)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+Query latency of the song search index against library size.
+
+Usage:
+    python -m benchmarks.bench_search [sizes...]
+"""
+
+import sys
+import time
+import random
+
+from VitasBot.search import SearchIndex
+
+QUERIES = ["vitas 7th element", "vitas opera 2", "vitsa 7th elemnt",
+           "star dedication", "mama live", "kingdom of birds remix"]
+
+COMMON = ["vitas", "opera", "star", "dedication", "element", "7th", "mama",
+          "birds", "kingdom", "of", "live", "remix", "version", "feat"]
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "ne", "to", "vi", "sa", "de", "ru",
+             "zo", "li", "na", "po", "te", "gra", "chev", "sko", "va", "di"]
+
+def make_titles(count, seed=0):
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice(SYLLABLES) for i in range(rng.randint(2, 4)))
+                  for i in range(max(100, count // 5))]
+    titles = set()
+
+    while len(titles) < count:
+        words = ["vitas"] if rng.random() < 0.5 else []
+        words += rng.sample(COMMON, rng.randint(0, 2))
+        words += rng.sample(vocabulary, rng.randint(1, 4))
+        titles.add(" ".join(words))
+
+    return sorted(titles)
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def bench(size, repeat=200):
+    index = SearchIndex()
+    titles = make_titles(size)
+
+    t1 = time.perf_counter()
+    for title in titles:
+        index.add(title + ".mp3", title)
+    build = time.perf_counter() - t1
+
+    # Warm the expansion cache like a running bot would
+    for query in QUERIES:
+        index.search(query)
+
+    samples = []
+    for i in range(repeat):
+        query = QUERIES[i % len(QUERIES)]
+        t1 = time.perf_counter()
+        index.search(query)
+        samples.append((time.perf_counter() - t1) * 1000)
+
+    print("{0:>8} tracks  build {1:7.2f}s  p50 {2:7.3f}ms  p99 {3:7.3f}ms".format(
+        size, build, percentile(samples, 50), percentile(samples, 99)))
+
+def main():
+    sizes = [int(s) for s in sys.argv[1:]] or [1000, 10000, 100000]
+
+    for size in sizes:
+        bench(size)
+
+if __name__ == "__main__":
+    main()
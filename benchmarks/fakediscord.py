@@ -0,0 +1,607 @@
+# -*- coding: utf-8 -*-
+
+"""
+A local stand-in for Discord: the REST API, the gateway websocket and a
+voice UDP sink, enough for VitasBot to log in, see servers, take commands,
+join voice and stream audio without a network.
+
+Point a bot at it with patch_client(), which also swaps discord.py's voice
+client for one that sends plain RTP to the sink (the real one insists on a
+TLS voice websocket on port 443 and PyNaCl encryption). The /_control/
+routes inject gateway events and report what the bot did, for the load
+tests in bench_load.
+
+Usage:
+    python -m benchmarks.fakediscord [guilds] [port]
+"""
+
+import sys
+import json
+import time
+import socket
+import struct
+import asyncio
+import itertools
+
+from collections import defaultdict
+
+import aiohttp
+from aiohttp import web
+
+from VitasBot.voicestats import Histogram, INTERVAL_BUCKETS
+
+API_PATH = "/api/v6"
+DISCORD_EPOCH_MS = 1420070400000
+
+BOT_ID = "300000000000000001"
+OWNER_ID = "300000000000000002"
+USER_ID = "300000000000000003"
+GUILD_BASE = 400000000000000000
+
+# Gateway opcodes
+DISPATCH = 0
+HEARTBEAT = 1
+IDENTIFY = 2
+STATUS_UPDATE = 3
+VOICE_STATE = 4
+RESUME = 6
+INVALIDATE_SESSION = 9
+HELLO = 10
+HEARTBEAT_ACK = 11
+
+DISCOVERY_SIZE = 70
+RTP_HEADER = struct.Struct(">BBHII")
+# Packets further apart than this count as a late frame at the listener
+LATE_INTERVAL = 0.025
+
+def _user(user_id, name, bot=False):
+    return {"id": user_id, "username": name, "discriminator": "0001",
+            "avatar": None, "bot": bot}
+
+def _timestamp(now=None):
+    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(now))
+
+class Guild:
+    __slots__ = ("index", "id", "text_id", "voice_id", "ssrc")
+
+    def __init__(self, index):
+        self.index = index
+        self.id = str(GUILD_BASE + index * 3)
+        self.text_id = str(GUILD_BASE + index * 3 + 1)
+        self.voice_id = str(GUILD_BASE + index * 3 + 2)
+        self.ssrc = index + 1
+
+    def shard(self, shard_count):
+        return (int(self.id) >> 22) % shard_count
+
+    def to_dict(self):
+        members = [_user(BOT_ID, "VitasBot", bot=True), _user(OWNER_ID, "Owner"),
+                   _user(USER_ID, "Someone")]
+
+        return {
+            "id": self.id,
+            "name": "Guild {0}".format(self.index),
+            "region": "eu-west",
+            "owner_id": OWNER_ID,
+            "member_count": len(members),
+            "large": False,
+            "unavailable": False,
+            "roles": [{"id": self.id, "name": "@everyone", "permissions": 104324161,
+                       "position": 0, "color": 0, "hoist": False,
+                       "managed": False, "mentionable": False}],
+            "members": [{"user": u, "roles": [], "joined_at": _timestamp(),
+                         "deaf": False, "mute": False} for u in members],
+            "channels": [{"id": self.text_id, "name": "general", "type": 0,
+                          "position": 0, "permission_overwrites": []},
+                         {"id": self.voice_id, "name": "Music", "type": 2,
+                          "position": 1, "bitrate": 64000, "user_limit": 0,
+                          "permission_overwrites": []}],
+            "presences": [],
+            "voice_states": [],
+            "emojis": [],
+            "features": []
+        }
+
+class StreamStats:
+    # Arrival timing of one server's voice packets at the sink
+    __slots__ = ("connected", "first", "last", "packets", "late", "intervals")
+
+    def __init__(self):
+        self.connected = None
+        self.first = None
+        self.last = None
+        self.packets = 0
+        self.late = 0
+        self.intervals = Histogram(INTERVAL_BUCKETS)
+
+    def received(self, now):
+        if self.first is None:
+            self.first = now
+
+        if self.last is not None:
+            interval = now - self.last
+            self.intervals.observe(interval * 1000)
+
+            if interval > LATE_INTERVAL:
+                self.late += 1
+
+        self.last = now
+        self.packets += 1
+
+class VoiceSink(asyncio.DatagramProtocol):
+    # Answers IP discovery and times the RTP packets, which are never decoded
+
+    def __init__(self):
+        self.streams = defaultdict(StreamStats)
+        self.waiters = defaultdict(list)
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        now = time.perf_counter()
+
+        if len(data) == DISCOVERY_SIZE and not any(data[4:]):
+            ssrc, = struct.unpack_from(">I", data)
+            reply = bytearray(DISCOVERY_SIZE)
+            struct.pack_into(">I", reply, 0, ssrc)
+            host = addr[0].encode("ascii")
+            reply[4:4 + len(host)] = host
+            struct.pack_into("<H", reply, DISCOVERY_SIZE - 2, addr[1])
+            self.transport.sendto(bytes(reply), addr)
+
+            self.streams[ssrc].connected = now
+            self._wake(ssrc, "voice_connect")
+        elif len(data) > RTP_HEADER.size:
+            ssrc = RTP_HEADER.unpack_from(data)[4]
+            stream = self.streams[ssrc]
+            stream.received(now)
+
+            if stream.packets == 1:
+                self._wake(ssrc, "audio")
+
+    def wait(self, ssrc, event, loop):
+        future = loop.create_future()
+        self.waiters[ssrc].append((event, future))
+        return future
+
+    def _wake(self, ssrc, event):
+        waiting = self.waiters.get(ssrc, [])
+
+        for entry in [w for w in waiting if w[0] == event]:
+            waiting.remove(entry)
+
+            if not entry[1].done():
+                entry[1].set_result(time.perf_counter())
+
+    def reset(self):
+        self.streams.clear()
+
+    def to_dict(self):
+        intervals = Histogram(INTERVAL_BUCKETS)
+        packets = late = 0
+
+        for stream in self.streams.values():
+            packets += stream.packets
+            late += stream.late
+
+            for i, count in enumerate(stream.intervals.counts):
+                intervals.counts[i] += count
+
+            intervals.count += stream.intervals.count
+            intervals.sum += stream.intervals.sum
+            intervals.max = max(intervals.max, stream.intervals.max)
+
+        return {
+            "streams": len(self.streams),
+            "packets": packets,
+            "late": late,
+            "interval_ms": intervals.to_dict(),
+            "interval_p50_ms": intervals.percentile(0.5),
+            "interval_p99_ms": intervals.percentile(0.99),
+            "interval_max_ms": intervals.max
+        }
+
+class GatewaySession:
+    __slots__ = ("ws", "shard_id", "shard_count", "sequence")
+
+    def __init__(self, ws, shard_id, shard_count):
+        self.ws = ws
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.sequence = 0
+
+    def dispatch(self, event, data):
+        self.sequence += 1
+        self.ws.send_str(json.dumps({"op": DISPATCH, "t": event,
+            "s": self.sequence, "d": data}))
+
+class FakeDiscord:
+    def __init__(self, *, guilds=100, host="127.0.0.1", port=8800, voice_port=None,
+                 loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.host = host
+        self.port = port
+        self.voice_port = voice_port or port + 1
+        self.guilds = [Guild(i) for i in range(guilds)]
+        self.by_channel = {}
+        self.sink = VoiceSink()
+
+        self.sessions = {}
+        self.voice_states = {}
+        self.replies = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.statuses = []
+
+        self._ids = itertools.count()
+        self._app = None
+        self._handler = None
+        self._server = None
+
+        for guild in self.guilds:
+            self.by_channel[guild.text_id] = guild
+            self.by_channel[guild.voice_id] = guild
+
+    @property
+    def base_url(self):
+        return "http://{0}:{1}".format(self.host, self.port)
+
+    def snowflake(self):
+        ms = int(time.time() * 1000) - DISCORD_EPOCH_MS
+        return str(ms << 22 | next(self._ids) % (1 << 22))
+
+    async def start(self):
+        self._app = web.Application(loop=self.loop)
+        router = self._app.router
+
+        router.add_route("GET", "/gateway", self.handle_gateway)
+        router.add_route("GET", API_PATH + "/gateway", self.handle_gateway_url)
+        router.add_route("GET", API_PATH + "/gateway/bot", self.handle_gateway_url)
+        router.add_route("GET", API_PATH + "/users/@me", self.handle_me)
+        router.add_route("POST", API_PATH + "/channels/{channel_id}/messages",
+            self.handle_create_message)
+        router.add_route("*", API_PATH + "/{path:.*}", self.handle_other)
+
+        router.add_route("GET", "/_control/guilds", self.control_guilds)
+        router.add_route("GET", "/_control/state", self.control_state)
+        router.add_route("POST", "/_control/reset", self.control_reset)
+        router.add_route("POST", "/_control/flood", self.control_flood)
+        router.add_route("POST", "/_control/command", self.control_command)
+
+        self._handler = self._app.make_handler()
+        self._server = await self.loop.create_server(self._handler, self.host, self.port)
+        await self.loop.create_datagram_endpoint(lambda: self.sink,
+            local_addr=(self.host, self.voice_port))
+
+    async def stop(self):
+        for session in list(self.sessions.values()):
+            await session.ws.close()
+
+        self.sink.transport.close()
+        self._server.close()
+        await self._server.wait_closed()
+        await self._handler.finish_connections(1.0)
+        await self._app.finish()
+
+    def session_for(self, guild):
+        for session in self.sessions.values():
+            if guild.shard(session.shard_count) == session.shard_id:
+                return session
+
+        return None
+
+    # Gateway
+
+    async def handle_gateway(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        ws.send_str(json.dumps({"op": HELLO, "d": {"heartbeat_interval": 41250,
+            "_trace": ["fake-gateway"]}}))
+        session = None
+
+        while True:
+            msg = await ws.receive()
+
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                break
+
+            payload = json.loads(msg.data)
+            op = payload.get("op")
+            data = payload.get("d")
+
+            if op == HEARTBEAT:
+                ws.send_str(json.dumps({"op": HEARTBEAT_ACK}))
+            elif op == IDENTIFY:
+                shard_id, shard_count = data.get("shard", [0, 1])
+                session = self.sessions[shard_id] = GatewaySession(ws, shard_id,
+                    shard_count)
+                self.identify(session)
+            elif op == RESUME:
+                ws.send_str(json.dumps({"op": INVALIDATE_SESSION, "d": False}))
+            elif op == STATUS_UPDATE:
+                self.statuses.append((time.perf_counter(), data.get("game")))
+                self.counters["status_updates"] += 1
+            elif op == VOICE_STATE and session is not None:
+                self.voice_state(session, data)
+
+        if session is not None and self.sessions.get(session.shard_id) is session:
+            del self.sessions[session.shard_id]
+
+        return ws
+
+    def identify(self, session):
+        guilds = [g.to_dict() for g in self.guilds
+                  if g.shard(session.shard_count) == session.shard_id]
+
+        session.dispatch("READY", {
+            "v": 6,
+            "user": _user(BOT_ID, "VitasBot", bot=True),
+            "guilds": guilds,
+            "private_channels": [],
+            "session_id": "fake-session-{0}".format(session.shard_id),
+            "_trace": ["fake-gateway"]
+        })
+
+    def voice_state(self, session, data):
+        guild = self.by_channel.get(data.get("channel_id")) or \
+            next((g for g in self.guilds if g.id == data.get("guild_id")), None)
+
+        if guild is None:
+            return
+
+        connected = guild.id in self.voice_states
+        channel_id = data.get("channel_id")
+        self.counters["voice_state_updates"] += 1
+
+        if channel_id is None:
+            self.voice_states.pop(guild.id, None)
+        else:
+            self.voice_states[guild.id] = channel_id
+
+        session.dispatch("VOICE_STATE_UPDATE", {
+            "guild_id": guild.id,
+            "channel_id": channel_id,
+            "user_id": BOT_ID,
+            "session_id": "fake-voice-{0}".format(guild.id),
+            "deaf": False, "mute": False, "suppress": False,
+            "self_deaf": data.get("self_deaf", False),
+            "self_mute": data.get("self_mute", False)
+        })
+
+        # The voice server is only handed out on a fresh connection, as
+        # Discord does; a move keeps it
+        if channel_id is not None and not connected:
+            session.dispatch("VOICE_SERVER_UPDATE", {
+                "guild_id": guild.id,
+                "token": str(guild.ssrc),
+                "endpoint": "{0}:{1}".format(self.host, self.voice_port)
+            })
+
+    def inject_message(self, guild, content, author_id=OWNER_ID):
+        session = self.session_for(guild)
+
+        if session is None:
+            raise web.HTTPServiceUnavailable(text="No shard holds {0}".format(guild.id))
+
+        name = "Owner" if author_id == OWNER_ID else "Someone"
+        session.dispatch("MESSAGE_CREATE", self._message(guild.text_id, content,
+            _user(author_id, name)))
+        self.counters["messages_injected"] += 1
+
+    def _message(self, channel_id, content, author, attachments=()):
+        return {
+            "id": self.snowflake(),
+            "channel_id": channel_id,
+            "author": author,
+            "content": content,
+            "timestamp": _timestamp(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": list(attachments),
+            "embeds": [],
+            "reactions": [],
+            "pinned": False,
+            "type": 0
+        }
+
+    # REST
+
+    def _json(self, data, status=200):
+        return web.Response(status=status, body=json.dumps(data).encode("utf-8"),
+            headers={"Content-Type": "application/json"})
+
+    async def handle_gateway_url(self, request):
+        return self._json({"url": "ws://{0}:{1}/gateway".format(self.host, self.port),
+                           "shards": 1})
+
+    async def handle_me(self, request):
+        return self._json(_user(BOT_ID, "VitasBot", bot=True))
+
+    async def handle_create_message(self, request):
+        channel_id = request.match_info["channel_id"]
+        attachments = []
+
+        if request.content_type == "application/json":
+            content = (await request.json()).get("content")
+        else:
+            form = await request.post()
+            content = json.loads(form.get("payload_json", "{}")).get("content")
+            upload = form.get("file")
+
+            if upload is not None:
+                attachments.append({"id": self.snowflake(), "filename": upload.filename,
+                    "url": "http://{0}:{1}/attachments/{2}".format(self.host,
+                    self.port, upload.filename)})
+
+        self.counters["messages_sent"] += 1
+        waiting = self.replies.pop(channel_id, [])
+
+        for future in waiting:
+            if not future.done():
+                future.set_result(time.perf_counter())
+
+        return self._json(self._message(channel_id, content,
+            _user(BOT_ID, "VitasBot", bot=True), attachments))
+
+    async def handle_other(self, request):
+        self.counters["{0} {1}".format(request.method,
+            request.match_info["path"].split("/")[0])] += 1
+
+        if request.method == "DELETE" or request.path.endswith("bulk_delete"):
+            return web.Response(status=204)
+
+        return self._json({})
+
+    # Control
+
+    async def control_guilds(self, request):
+        return self._json([{"id": g.id, "text": g.text_id, "voice": g.voice_id,
+                            "ssrc": g.ssrc} for g in self.guilds])
+
+    async def control_state(self, request):
+        return self._json({
+            "shards": sorted(self.sessions),
+            "counters": self.counters,
+            "voice_connections": len(self.voice_states),
+            "voice": self.sink.to_dict()
+        })
+
+    async def control_reset(self, request):
+        self.counters.clear()
+        self.statuses.clear()
+        self.sink.reset()
+        return self._json({})
+
+    async def control_flood(self, request):
+        # Messages across every server, most of them not commands at all
+        body = await request.json()
+        count = body.get("count", 10000)
+        contents = body.get("contents", ["hello there"])
+        author = body.get("author", USER_ID)
+        started = time.perf_counter()
+
+        for i in range(count):
+            self.inject_message(self.guilds[i % len(self.guilds)],
+                contents[i % len(contents)], author)
+
+            # Let the socket drain now and then, like a real gateway would
+            if i % 500 == 499:
+                await asyncio.sleep(0, loop=self.loop)
+
+        return self._json({"count": count, "seconds": time.perf_counter() - started})
+
+    async def control_command(self, request):
+        # Sends a command as the owner and waits for its effect: a reply in
+        # the channel, the voice connection or the first audio packet
+        body = await request.json()
+        guild = self.by_channel[body["channel_id"]]
+        wait = body.get("wait", "reply")
+
+        if wait == "none":
+            self.inject_message(guild, body["content"])
+            return self._json({"latency": None})
+        elif wait == "reply":
+            future = self.loop.create_future()
+            self.replies[guild.text_id].append(future)
+        else:
+            future = self.sink.wait(guild.ssrc, wait, self.loop)
+
+        started = time.perf_counter()
+        self.inject_message(guild, body["content"])
+
+        try:
+            done = await asyncio.wait_for(future, body.get("timeout", 30), loop=self.loop)
+        except asyncio.TimeoutError:
+            return self._json({"latency": None})
+
+        return self._json({"latency": done - started})
+
+class _SinkSocket:
+    # Stands in for the voice websocket, which the sink does not need
+    open = True
+
+    async def close(self):
+        self.open = False
+
+def sink_voice_client():
+    import discord
+
+    class SinkVoiceClient(discord.VoiceClient):
+        # Sends unencrypted RTP straight to the sink after IP discovery
+
+        def __init__(self, user, main_ws, session_id, channel, data, loop):
+            self.user = user
+            self.main_ws = main_ws
+            self.channel = channel
+            self.session_id = session_id
+            self.loop = loop
+            self._connected = asyncio.Event(loop=loop)
+            self.token = data.get("token")
+            self.guild_id = data.get("guild_id")
+            self.endpoint = data.get("endpoint")
+            self.sequence = 0
+            self.timestamp = 0
+            self.encoder = discord.opus.Encoder(48000, 2)
+
+        async def connect(self):
+            host, port = self.endpoint.rsplit(":", 1)
+            self.endpoint_ip = host
+            self.voice_port = int(port)
+            self.ssrc = int(self.token)
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.setblocking(False)
+            self.ws = _SinkSocket()
+
+            packet = bytearray(DISCOVERY_SIZE)
+            struct.pack_into(">I", packet, 0, self.ssrc)
+            self.socket.sendto(packet, (self.endpoint_ip, self.voice_port))
+            await asyncio.wait_for(self.loop.sock_recv(self.socket, DISCOVERY_SIZE),
+                10, loop=self.loop)
+            self._connected.set()
+
+        def _get_voice_packet(self, data):
+            return RTP_HEADER.pack(0x80, 0x78, self.sequence, self.timestamp,
+                self.ssrc) + data
+
+    return SinkVoiceClient
+
+def patch_client(base_url):
+    # Sends a discord.py client to the fake instead of Discord
+    import discord
+    import discord.http
+
+    discord.http.Route.BASE = base_url + API_PATH
+    discord.VoiceClient = sink_voice_client()
+
+def serve(guilds, port, ready=None):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    fake = FakeDiscord(guilds=guilds, port=port, loop=loop)
+    loop.run_until_complete(fake.start())
+
+    if ready is not None:
+        ready.set()
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(fake.stop())
+        loop.close()
+
+def main():
+    guilds = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8800
+
+    print("Fake Discord with {0} servers on http://127.0.0.1:{1}, voice on "
+          "udp/{2}".format(guilds, port, port + 1))
+    print("Owner id {0}".format(OWNER_ID))
+    serve(guilds, port)
+
+if __name__ == "__main__":
+    main()
@@ -24,11 +24,21 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import logging
+
 from VitasBot import Config
 from VitasBot import VitasBot
+from VitasBot.shards import launch
+
+CONFIG_FILE = "config/config.ini"
 
 def main():
-    config = Config("config/config.ini")
+    config = Config(CONFIG_FILE)
+
+    if config.shards > 1:
+        logging.basicConfig(level=logging.INFO, format="{message}", style="{")
+        launch(CONFIG_FILE, config.shards)
+        return
 
     vitas_bot = VitasBot(config)
     vitas_bot.run()